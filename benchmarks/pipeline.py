@@ -0,0 +1,265 @@
+"""
+Measures each stage of the sorting pipeline on a synthetic corpus of photos : scan, exif, geocode, dedupe, rename, revert.
+
+The corpus mixes photos with full EXIF (DateTime, SubSecTimeOriginal, GPS), bursts of photos taken the same minute,
+WhatsApp-like names without EXIF and photos without any date. Locations are resolved by a local HTTP server
+answering like OpenStreetMap Nominatim, such that no request leaves the machine.
+
+Usage : python benchmarks/pipeline.py [--files N] [--output results.json]
+"""
+import os
+import sys
+import json
+import time
+import random
+import struct
+import shutil
+import tempfile
+import threading
+import http.server
+import urllib.parse
+
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import photosorter_core as photosorter
+
+################################### Corpus #########################################################
+
+TIFF_ASCII = 2
+TIFF_LONG = 4
+TIFF_RATIONAL = 5
+
+
+def tiff_ifd(entries:list[tuple], offset:int) -> bytes:
+    """
+    @param entries list of (tag, type, count, value bytes), sorted by tag.
+    @param offset of this IFD in the TIFF block, values larger than 4 bytes being stored right after it.
+    """
+    data_offset = offset + 2 + 12 * len(entries) + 4
+    ifd = struct.pack('>H', len(entries))
+    data = b''
+    for tag, tag_type, count, value in entries:
+        if len(value) <= 4:
+            ifd += struct.pack('>HHI', tag, tag_type, count) + value.ljust(4, b'\0')
+        else:
+            ifd += struct.pack('>HHII', tag, tag_type, count, data_offset + len(data))
+            data += value + (b'\0' if len(value) % 2 else b'')
+    return ifd + struct.pack('>I', 0) + data
+
+
+def ascii_entry(tag:int, text:str) -> tuple:
+    value = text.encode('ascii') + b'\0'
+    return tag, TIFF_ASCII, len(value), value
+
+
+def degrees_entry(tag:int, decimal:float) -> tuple:
+    degrees = int(decimal)
+    minutes = int((decimal - degrees) * 60)
+    milliseconds = int(((decimal - degrees) * 60 - minutes) * 60 * 1000)
+    return tag, TIFF_RATIONAL, 3, struct.pack('>6I', degrees, 1, minutes, 1, milliseconds, 1000)
+
+
+def exif_block(date_time:str | None, subsec:str | None, coordinates:tuple[float, float] | None) -> bytes:
+    """
+    @return TIFF block of EXIF APP1 segment, with IFD0, Exif sub IFD and GPS IFD.
+    """
+    ifd0_entries = []
+    if date_time is not None:
+        ifd0_entries.append(ascii_entry(0x0132, date_time))
+    pointers = []
+    if subsec is not None:
+        pointers.append(0x8769)
+    if coordinates is not None:
+        pointers.append(0x8825)
+    # Sub IFDs are written after IFD0, whose size does not depend on pointers values
+    ifd0_size = len(tiff_ifd(ifd0_entries + [(pointer, TIFF_LONG, 1, b'\0' * 4) for pointer in pointers], 8))
+    sub_ifds = b''
+    offset = 8 + ifd0_size
+    if subsec is not None:
+        ifd0_entries.append((0x8769, TIFF_LONG, 1, struct.pack('>I', offset + len(sub_ifds))))
+        sub_ifds += tiff_ifd([ascii_entry(0x9003, date_time), ascii_entry(0x9291, subsec)], offset + len(sub_ifds))
+    if coordinates is not None:
+        latitude, longitude = coordinates
+        ifd0_entries.append((0x8825, TIFF_LONG, 1, struct.pack('>I', offset + len(sub_ifds))))
+        sub_ifds += tiff_ifd([
+            ascii_entry(0x0001, 'N' if latitude >= 0 else 'S'),
+            degrees_entry(0x0002, abs(latitude)),
+            ascii_entry(0x0003, 'E' if longitude >= 0 else 'W'),
+            degrees_entry(0x0004, abs(longitude)),
+        ], offset + len(sub_ifds))
+    ifd0_entries.sort()
+    return b'MM\0*' + struct.pack('>I', 8) + tiff_ifd(ifd0_entries, 8) + sub_ifds
+
+
+def write_jpeg(pathname:str, exif:bytes | None, image_size:int):
+    """
+    Writes a JPEG made of an optional EXIF segment followed by image_size bytes of fake compressed data.
+    """
+    with open(pathname, 'wb') as jpeg_file:
+        jpeg_file.write(b'\xff\xd8')
+        # JFIF segment, as written by most cameras before EXIF
+        jpeg_file.write(b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\0\x01\x01\0\0\x01\0\x01\0\0')
+        if exif is not None:
+            segment = b'Exif\0\0' + exif
+            jpeg_file.write(b'\xff\xe1' + struct.pack('>H', len(segment) + 2) + segment)
+        jpeg_file.write(b'\xff\xda' + struct.pack('>H', 2))
+        jpeg_file.write(os.urandom(image_size))
+        jpeg_file.write(b'\xff\xd9')
+
+
+def generate_corpus(directory:str, files_count:int, image_size:int = 4096, seed:int = 0) -> dict:
+    """
+    Writes files_count synthetic photos in directory.
+    @return count of photos of each kind.
+    """
+    generator = random.Random(seed)
+    # A few places, such that many photos share the same location
+    places = [(generator.uniform(-60, 70), generator.uniform(-180, 180)) for _ in range(max(1, files_count // 50))]
+    kinds = {'exif':0, 'exif_gps':0, 'burst':0, 'whatsapp':0, 'no_date':0}
+    i = 0
+    while i < files_count:
+        date_time = f'{generator.randint(2000, 2024):04}:{generator.randint(1, 12):02}:{generator.randint(1, 28):02} {generator.randint(0, 23):02}:{generator.randint(0, 59):02}:{generator.randint(0, 59):02}'
+        draw = generator.random()
+        if draw < 0.02:
+            # Burst of photos taken the same minute
+            burst_size = min(generator.randint(5, 30), files_count - i)
+            coordinates = generator.choice(places)
+            for k in range(burst_size):
+                subsec = f'{generator.randint(0, 999):03}'
+                write_jpeg(os.path.join(directory, f'IMG_{i:08}.jpg'), exif_block(date_time[:-2] + f'{k % 60:02}', subsec, coordinates), image_size)
+                i += 1
+            kinds['burst'] += burst_size
+            continue
+        if draw < 0.5:
+            place = generator.choice(places)
+            coordinates = (place[0] + generator.uniform(-1e-3, 1e-3), place[1] + generator.uniform(-1e-3, 1e-3))
+            write_jpeg(os.path.join(directory, f'IMG_{i:08}.jpg'), exif_block(date_time, f'{generator.randint(0, 999):03}', coordinates), image_size)
+            kinds['exif_gps'] += 1
+        elif draw < 0.8:
+            write_jpeg(os.path.join(directory, f'DSC_{i:08}.JPG'), exif_block(date_time, None, None), image_size)
+            kinds['exif'] += 1
+        elif draw < 0.9:
+            name_date = date_time.replace(':', '-', 2).replace(' ', ' at ').replace(':', '.')
+            write_jpeg(os.path.join(directory, f'WhatsApp Image {name_date} ({i}).jpeg'), None, image_size)
+            kinds['whatsapp'] += 1
+        else:
+            write_jpeg(os.path.join(directory, f'scan_{i:08}.jpg'), None, image_size)
+            kinds['no_date'] += 1
+        i += 1
+    return kinds
+
+################################### Geocoder stub ##################################################
+
+class NominatimStubHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Answers reverse geocoding requests like Nominatim, with names derived from coordinates.
+    """
+    def do_GET(self):
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        latitude, longitude = float(query['lat'][0]), float(query['lon'][0])
+        body = json.dumps({
+            'lat': str(latitude),
+            'lon': str(longitude),
+            'display_name': 'Stub',
+            'address': {'country': f'Country{int(latitude) // 10}', 'town': f'Town{int(latitude)}_{int(longitude)}'},
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_nominatim_stub() -> http.server.ThreadingHTTPServer:
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), NominatimStubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+################################### Benchmark ######################################################
+
+class StageTimer:
+    def __init__(self) -> None:
+        self.stages = {}
+
+    def time(self, name:str, function, items_count:int):
+        start = time.perf_counter()
+        result = function()
+        seconds = time.perf_counter() - start
+        self.stages[name] = {'seconds':round(seconds, 6), 'items':items_count, 'items_per_second':round(items_count / seconds, 1) if seconds > 0 else None}
+        return result
+
+
+def run(files_count:int, image_size:int, jobs:int, seed:int) -> dict:
+    directory = tempfile.mkdtemp(prefix='photosorter-benchmark-')
+    server = start_nominatim_stub()
+    timer = StageTimer()
+    try:
+        kinds = generate_corpus(directory, files_count, image_size, seed)
+        # Results are measured without printing each file
+        with open(os.devnull, 'w') as devnull:
+            stdout = sys.stdout
+            sys.stdout = devnull
+            try:
+                photo_pathnames = timer.time('scan', lambda: list(photosorter.scan_photos(directory)), files_count)
+                photo_infos = timer.time('exif', lambda: [photo_info for photo_info in photosorter.imap_ordered(lambda pathname: photosorter.read_photo_info(pathname, True, True), photo_pathnames, jobs) if photo_info is not None], len(photo_pathnames))
+
+                geocoder = photosorter.CachedGeocoder(photosorter.NominatimGeocoder(domain=f'127.0.0.1:{server.server_port}', scheme='http'))
+                def geocode():
+                    scheduler = photosorter.GeocodingScheduler(geocoder, requests_per_second=0)
+                    futures = [scheduler.submit(photo_info.latitude, photo_info.longitude) for photo_info in photo_infos if photo_info.latitude is not None]
+                    locations = [future.result() for future in futures]
+                    scheduler.close()
+                    return locations
+                timer.time('geocode', geocode, sum(1 for photo_info in photo_infos if photo_info.latitude is not None))
+
+                new_pathnames = [photosorter.compute_new_pathname(photo_info, sort_by_dir=photosorter.SortByDir.SORT_BY_YEAR_AND_MONTH) for photo_info in photo_infos]
+                creation_keys = [(photo_info.date_time.second, photo_info.subsec, photo_info.mtime_ns, photo_info.pathname) for photo_info in photo_infos]
+                timer.time('dedupe', lambda: photosorter.number_duplicate_names(new_pathnames, creation_keys.__getitem__), len(new_pathnames))
+
+                def rename():
+                    journal = photosorter.RenameJournal(directory)
+                    photosorter.apply_renames([(photo_info.pathname, new_pathname, photo_info.size, photo_info.mtime_ns) for photo_info, new_pathname in zip(photo_infos, new_pathnames)], journal)
+                    journal.close()
+                timer.time('rename', rename, len(new_pathnames))
+                timer.time('revert', lambda: photosorter.revert_directory(directory, jobs), len(new_pathnames))
+            finally:
+                sys.stdout = stdout
+    finally:
+        server.shutdown()
+        shutil.rmtree(directory, ignore_errors=True)
+    return {
+        'benchmark': 'pipeline',
+        'files': files_count,
+        'image_size': image_size,
+        'jobs': jobs,
+        'seed': seed,
+        'python': sys.version.split()[0],
+        'corpus': kinds,
+        'stages': timer.stages,
+    }
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='Measures each stage of the sorting pipeline on a synthetic corpus.')
+    argparser.add_argument('-n', '--files', help='Number of photos of the corpus (default 1000).', type=int, default=1000)
+    argparser.add_argument('--image-size', help='Bytes of image data of each photo (default 4096).', type=int, default=4096)
+    argparser.add_argument('-j', '--jobs', help='Number of photos processed in parallel.', type=int, default=1)
+    argparser.add_argument('--seed', help='Seed of the corpus generator.', type=int, default=0)
+    argparser.add_argument('-o', '--output', help='Writes results to given JSON file instead of standard output.')
+    args = argparser.parse_args()
+
+    results = run(args.files, args.image_size, args.jobs, args.seed)
+    if args.output is not None:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=4)
+    else:
+        json.dump(results, sys.stdout, indent=4)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Measures the cold start time of the photosorter command line, in milliseconds.
+
+Each scenario runs a fresh interpreter on an empty directory, such that the time measured
+is the startup cost : interpreter, compilation and imports. The bytecode of photosorter_core is
+compiled first, as done by the first run of a user, even if PYTHONDONTWRITEBYTECODE is set.
+
+Usage : python benchmarks/startup.py [--runs N]
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import statistics
+import py_compile
+import subprocess
+
+import argparse
+
+PHOTOSORTER_PATHNAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'photosorter.py')
+PHOTOSORTER_CORE_PATHNAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'photosorter_core.py')
+
+
+def measure(command:list[str], runs:int) -> dict:
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        durations.append(1000 * (time.perf_counter() - start))
+    return {
+        'median_ms': round(statistics.median(durations), 2),
+        'min_ms': round(min(durations), 2),
+        'max_ms': round(max(durations), 2),
+    }
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='Measures cold start time of the photosorter command line.')
+    argparser.add_argument('-n', '--runs', help='Number of runs of each scenario.', type=int, default=20)
+    args = argparser.parse_args()
+    py_compile.compile(PHOTOSORTER_CORE_PATHNAME, doraise=True)
+
+    with tempfile.TemporaryDirectory() as directory:
+        scenarios = {
+            # Reference : interpreter alone
+            'python': [sys.executable, '-c', 'pass'],
+            'revert': [sys.executable, PHOTOSORTER_PATHNAME, directory, '--revert'],
+            'sort': [sys.executable, PHOTOSORTER_PATHNAME, directory, '--no-index'],
+            'sort_with_index': [sys.executable, PHOTOSORTER_PATHNAME, directory],
+        }
+        results = {name:measure(command, args.runs) for name, command in scenarios.items()}
+    json.dump({'benchmark':'startup', 'runs':args.runs, 'results':results}, sys.stdout, indent=4)
+    print()
+
+
+if __name__ == "__main__":
+    main()
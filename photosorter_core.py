@@ -0,0 +1,3067 @@
+import os
+import re
+import errno
+import sys
+import fnmatch
+import struct
+import math
+import time
+import mmap
+import bisect
+import json
+
+from threading import Thread, Lock, Event, BoundedSemaphore
+from queue import SimpleQueue, Empty
+from enum import Enum
+from datetime import datetime, timedelta, timezone
+from array import array
+from collections import OrderedDict, deque
+from itertools import groupby
+from contextlib import contextmanager
+
+import argparse
+
+# Heavy modules (tkinter, exifread, geopy, unidecode, sqlite3, concurrent.futures) are imported only when needed,
+# such that command line calls start fast and do not require Tk.
+tk = None
+
+###################################     Compile       ##############################################
+
+# In order to create a single executable file, use 'pyinstaller photosorter.py -F'
+
+################################### Constants & Enums ##############################################
+
+PHOTOSORTER_SUBDIR = '.photosorter'
+GEOCODING_CACHE_FILENAME = 'geocoding.json'
+METADATA_INDEX_FILENAME = 'index.sqlite3'
+# Reports of renamed files in PHOTOSORTER_SUBDIR are named 1.jsonl, 2.jsonl... (1.json, 2.json... for older versions)
+REPORT_FILENAME_PATTERN = re.compile(r'(\d+)\.jsonl?')
+JOURNAL_VERSION = 1
+# Photos and videos processed by default, case-insensitive
+PHOTO_PATTERNS = ['*.jpg', '*.jpeg', '*.heic', '*.heif', '*.png', '*.mp4', '*.mov']
+# Extensions of renamed files, lower case original extension otherwise
+RENAMED_EXTENSIONS = {'.jpeg':'.jpg'}
+# Subdirectories created by SortByDir
+SORTED_DIRECTORY_PATTERN = re.compile(r'\d{4}(-\d{2})?')
+# Names numbered by number_duplicate_names : name, number, extension
+NUMBERED_NAME_PATTERN = re.compile(r'(.*?)(?:-(\d+))?(\.[^.]*)?')
+# Sources of the date of a photo, tried in this order by default (see resolve_date_time), 'mtime' being the date of last modification
+DATE_SOURCES = ['original', 'digitized', 'datetime', 'filename']
+ALL_DATE_SOURCES = DATE_SOURCES + ['mtime']
+# Index in PhotoInfo.exif_date_times of EXIF date sources, and their tag
+EXIF_DATE_SOURCES = {'original':0, 'digitized':1, 'datetime':2}
+EXIF_DATE_TAGS = ('EXIF DateTimeOriginal', 'EXIF DateTimeDigitized', 'Image DateTime')
+# Names of files of phones and applications containing their date, {Y} {M} {D} {h} {m} {s} being its fields
+FILENAME_DATE_PATTERNS = [
+    # WhatsApp Image 2023-11-02 at 14.54.57.jpeg
+    r'WhatsApp Image {Y}-{M}-{D} at {h}\.{m}\.{s}',
+    # PXL_20231102_145457123.jpg, IMG_20231102_145457.jpg, VID_20231102_145457.mp4, 20231102_145457.jpg
+    r'(?:PXL_|IMG_|VID_|^){Y}{M}{D}_{h}{m}{s}',
+    # Screenshot_20231102-145457.png, Screenshot_2023-11-02-14-54-57.png
+    r'Screenshot_{Y}-?{M}-?{D}[-_]{h}-?{m}-?{s}',
+    # Screenshot 2023-11-02 at 14.54.57.png
+    r'Screenshot {Y}-{M}-{D} at {h}\.{m}\.{s}',
+    # signal-2023-11-02-145457.jpg, signal-2023-11-02-14-54-57-123.jpg
+    r'signal-{Y}-{M}-{D}-{h}-?{m}-?{s}',
+    # photo_1@02-11-2023_14-54-57.jpg exported by Telegram
+    r'photo_\d+@{D}-{M}-{Y}_{h}-{m}-{s}',
+]
+# Subdirectory where duplicate photos are moved, never scanned
+DUPLICATES_SUBDIR = 'duplicates'
+# Duplicates are first found by hashing this many bytes at start and end of files, then by hashing whole files
+DEDUPE_SAMPLE_SIZE = 64 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+# Files moved to another file system are copied by chunks of this size, at most MAX_TRANSFERS at once per process
+TRANSFER_CHUNK_SIZE = 8 * 1024 * 1024
+MAX_TRANSFERS = 2
+# Watch mode : new photos are sorted once unchanged for WATCH_DEBOUNCE seconds, by batches of at most WATCH_BATCH_SIZE
+WATCH_DEBOUNCE = 0.5
+WATCH_BATCH_SIZE = 256
+WATCH_POLL_INTERVAL = 1.0
+
+class SortByDir(Enum):
+    SORT_BY_NONE = 0
+    SORT_BY_YEAR = SORT_BY_NONE+1
+    SORT_BY_MONTH = SORT_BY_YEAR+1
+    SORT_BY_YEAR_AND_MONTH = SORT_BY_MONTH+1
+
+class PhotoEventKind(Enum):
+    RENAMED = 0
+    PLANNED = RENAMED+1
+    UNCHANGED = PLANNED+1
+    FAILED = UNCHANGED+1
+    DUPLICATE = FAILED+1
+
+class PhotoInfo:
+    """
+    Metadata of a photo used to compute its new name.
+    """
+    __slots__ = ('pathname', 'date_time', 'datetime_from_exif', 'gps_read', 'latitude', 'longitude', 'country', 'town', 'exif_date_times', 'subsec', 'size', 'mtime_ns')
+
+    def __init__(self, pathname:str, date_time:datetime | None, datetime_from_exif:bool = True, latitude:float | None = None, longitude:float | None = None) -> None:
+        self.pathname = pathname
+        self.date_time = date_time
+        self.datetime_from_exif = datetime_from_exif
+        # Whether coordinates were looked for in metadata
+        self.gps_read = False
+        self.latitude = latitude
+        self.longitude = longitude
+        # Location, None until resolved
+        self.country = None
+        self.town = None
+        # Dates found in EXIF, see EXIF_DATE_SOURCES
+        self.exif_date_times = (None, None, None)
+        # Fraction of second of creation, size and modification time of file
+        self.subsec = 0.0
+        self.size = 0
+        self.mtime_ns = 0
+
+class Translator:
+    class Language(Enum):
+        ENGLISH = -1
+        FRENCH = 0
+
+    # To add other languages, create an index in enum, and fill all tuples in TRANSLATIONS at your index
+    # In all cases, english is the key to all other languages
+    TRANSLATIONS = {
+        # First entry are the languages available
+        'anglais':['francais'],
+        'Photo Sorter':['Photo Sorter'],
+        'Directory to process':['Dossier à traiter'],
+        'Open directory':['Ouvrir dossier'],
+        'Options':['Options'],
+        'Use GPS data (slow)':['Utiliser données GPS (lent)'],
+        'y/n':['o/n'],
+        'Optional files suffix':['Suffixe optionnel'],
+        'Sort in subdirectories':['Trier en sous-dossiers'],
+        'Do not sort':['Ne pas trier'],
+        'Year/':['Année/'],
+        'Year-Month/':['Année-Mois/'],
+        'Year/Month/':['Année/Mois/'],
+        'Revert':['Restaurer'],
+        'Start':['Start'],
+        'App is ready':['Application prête'],
+        'APP IS BUSY':['EXECUTION EN COURS'],
+        'Info':['Info'],
+        'Error':['Erreur'],
+        'Please wait until operation is finished':['Merci d\'attendre la fin de l\'execution'],
+        'Revert successful !':['Restauration réussie !'],
+        'Nothing to revert in this directory':['Rien à restaurer dans ce dossier'],
+        'An error occurred':['Une erreur est survenue'],
+        'Please give directory to process':['Merci de fournir un dossier à traiter'],
+        'Operation successful !':['Traitement réussi !'],
+        'Language':['Langue'],
+        'Use creation date when EXIF missing':['Utiliser date de creation si EXIF manquant'],
+        'Cancel':['Annuler'],
+        'Operation cancelled':['Traitement annulé'],
+        'Remaining time':['Temps restant'],
+    }
+
+    def __init__(self, language:Language = Language.ENGLISH) -> None:
+        self.language = language
+
+    def translate(self, message:str) -> str:
+        if self.language != Translator.Language.ENGLISH and (message in Translator.TRANSLATIONS.keys()):
+            return Translator.TRANSLATIONS[message][self.language.value]
+        else:
+            return message
+
+
+################################### GUI ############################################################
+
+class PhotoSorterGui:
+    # Progress is drawn at most once per interval, whatever the number of photos processed meanwhile
+    REFRESH_INTERVAL_MS = 100
+
+    def __init__(self) -> None:
+        self.translator = Translator(Translator.Language.ENGLISH)
+
+        # Main window
+        self.root = tk.Tk()
+        self.root.title('Photo Sorter')
+        self.root.geometry('640x480')
+        self.root.protocol("WM_DELETE_WINDOW", self.on_exit)
+
+        # Variables
+        self.directory = tk.StringVar()
+        self.language = tk.IntVar()
+        self.language.set(Translator.Language.ENGLISH.value)
+        self.fallback_datetime = tk.BooleanVar()
+        self.fallback_datetime.set(False)
+        self.use_gps = tk.BooleanVar()
+        self.use_gps.set(True)
+        self.suffix = tk.StringVar()
+        self.suffix.set('')
+        self.sort_by_dir = tk.IntVar()
+        self.sort_by_dir.set(SortByDir.SORT_BY_NONE.value)
+        self.busy = tk.BooleanVar()
+        self.busy.set(False)
+        # Filled by the job thread, emptied by the Tk main loop only
+        self.events = SimpleQueue()
+        self.sorter = None
+        self.progress_events = ()
+        self.done_count = 0
+        self.total_count = 0
+        self.start_time = 0.0
+
+        # Directory frame
+        self.directory_lblfrm = tk.LabelFrame(self.root)
+        self.directory_lblfrm.pack(fill='x')
+
+        self.directory_lbl = tk.Label(self.directory_lblfrm, textvariable=self.directory, relief='sunken')
+        self.directory_lbl.pack(side=tk.RIGHT, fill='x', padx=10, pady=10, expand=True)
+        self.open_dir_btn = tk.Button(self.directory_lblfrm, command=self.on_open_dir_btn_click)
+        self.open_dir_btn.pack(side=tk.LEFT, pady=10)
+
+        # Options frame
+        self.options_lblfrm = tk.LabelFrame(self.root)
+        self.options_lblfrm.pack(fill='both', pady=10)
+
+        self.language_frm = tk.Frame(self.options_lblfrm)
+        self.language_frm.pack(side=tk.TOP, fill='x')
+        self.language_lbl = tk.Label(self.language_frm)
+        self.language_lbl.pack(side=tk.LEFT)
+        self.language_english_radiobtn = tk.Radiobutton(self.language_frm, text='english', variable=self.language, value=Translator.Language.ENGLISH.value, command=self.translate)
+        self.language_english_radiobtn.pack(side=tk.RIGHT, padx=10)
+        self.language_french_radiobtn = tk.Radiobutton(self.language_frm, text='francais', variable=self.language, value=Translator.Language.FRENCH.value, command=self.translate)
+        self.language_french_radiobtn.pack(side=tk.RIGHT, padx=10)
+
+        self.fallback_datetime_frm = tk.Frame(self.options_lblfrm)
+        self.fallback_datetime_frm.pack(side=tk.TOP, fill='x')
+        self.fallback_datetime_lbl = tk.Label(self.fallback_datetime_frm)
+        self.fallback_datetime_lbl.pack(side=tk.LEFT)
+        self.fallback_datetime_chk = tk.Checkbutton(self.fallback_datetime_frm, variable=self.fallback_datetime)
+        self.fallback_datetime_chk.pack(side=tk.RIGHT, expand=True)
+
+        self.gps_frm = tk.Frame(self.options_lblfrm)
+        self.gps_frm.pack(side=tk.TOP, fill='x')
+        self.gps_lbl = tk.Label(self.gps_frm)
+        self.gps_lbl.pack(side=tk.LEFT)
+        self.gps_chk = tk.Checkbutton(self.gps_frm, variable=self.use_gps)
+        self.gps_chk.pack(side=tk.RIGHT, expand=True)
+
+        self.suffix_frm = tk.Frame(self.options_lblfrm)
+        self.suffix_frm.pack(side=tk.TOP, fill='x')
+        self.suffix_lbl = tk.Label(self.suffix_frm)
+        self.suffix_lbl.pack(side=tk.LEFT)
+        self.suffix_entry = tk.Entry(self.suffix_frm, textvariable=self.suffix, width=50)
+        self.suffix_entry.pack(side=tk.RIGHT, fill='x', expand=True, padx=10)
+
+        self.sort_by_dir_frm = tk.Frame(self.options_lblfrm)
+        self.sort_by_dir_frm.pack(side=tk.TOP, fill='x')
+        self.sort_by_dir_lbl = tk.Label(self.sort_by_dir_frm)
+        self.sort_by_dir_lbl.pack(side=tk.LEFT)
+        self.sort_by_dir_none_radiobtn = tk.Radiobutton(self.sort_by_dir_frm, variable=self.sort_by_dir, value=SortByDir.SORT_BY_NONE.value)
+        self.sort_by_dir_none_radiobtn.pack(side=tk.RIGHT, padx=10)
+        self.sort_by_dir_year_radiobtn= tk.Radiobutton(self.sort_by_dir_frm, variable=self.sort_by_dir, value=SortByDir.SORT_BY_YEAR.value)
+        self.sort_by_dir_year_radiobtn.pack(side=tk.RIGHT, padx=10)
+        self.sort_by_dir_month_radiobtn = tk.Radiobutton(self.sort_by_dir_frm, variable=self.sort_by_dir, value=SortByDir.SORT_BY_MONTH.value)
+        self.sort_by_dir_month_radiobtn.pack(side=tk.RIGHT, padx=10)
+        self.sort_by_dir_year_and_month_radiobtn = tk.Radiobutton(self.sort_by_dir_frm, variable=self.sort_by_dir, value=SortByDir.SORT_BY_YEAR_AND_MONTH.value)
+        self.sort_by_dir_year_and_month_radiobtn.pack(side=tk.RIGHT, padx=10)
+
+        # Start frame
+        self.start_lblfrm = tk.LabelFrame(self.root, text='')
+        self.start_lblfrm.pack(side=tk.BOTTOM, fill='x')
+
+        self.start_frm = tk.Frame(self.start_lblfrm)
+        self.start_frm.pack(side=tk.TOP, fill='x')
+        self.revert_btn = tk.Button(self.start_lblfrm, command=self.on_revert_btn_click)
+        self.revert_btn.pack(side=tk.LEFT, padx=10, pady=10)
+        self.start_btn = tk.Button(self.start_lblfrm, command=self.on_start_btn_click)
+        self.start_btn.pack(side=tk.RIGHT, padx=10, pady=10)
+        self.cancel_btn = tk.Button(self.start_lblfrm, command=self.on_cancel_btn_click, state=tk.DISABLED)
+        self.cancel_btn.pack(side=tk.RIGHT, padx=10, pady=10)
+        self.progress_bar = tk.ttk.Progressbar(self.start_lblfrm, mode='determinate')
+        self.progress_bar.pack(side=tk.TOP, fill='x', padx=10, pady=5)
+        self.progress_lbl = tk.Label(self.start_lblfrm)
+        self.progress_lbl.pack(side=tk.TOP, fill='x')
+        self.busy_lbl = tk.Label(self.start_lblfrm, bg='green', borderwidth=2, relief="sunken")
+        self.busy_lbl.pack(side=tk.BOTTOM, fill='both', expand=True)
+
+        # Launch mainloop
+        self.translate()
+        self.root.mainloop()
+
+    def translate(self):
+        self.translator.language = Translator.Language(self.language.get())
+        self.directory_lblfrm.config(text=self.translator.translate('Directory to process'))
+        self.open_dir_btn.config(text=self.translator.translate('Open directory'))
+        self.options_lblfrm.config(text=self.translator.translate('Options'))
+        self.language_lbl.config(text=self.translator.translate('Language'))
+        self.fallback_datetime_lbl.config(text=self.translator.translate('Use creation date when EXIF missing'))
+        self.fallback_datetime_chk.config(text=self.translator.translate('y/n'))
+        self.gps_lbl.config(text=self.translator.translate('Use GPS data (slow)'))
+        self.gps_chk.config(text=self.translator.translate('y/n'))
+        self.suffix_lbl.config(text=self.translator.translate('Optional files suffix'))
+        self.sort_by_dir_lbl.config(text=self.translator.translate('Sort in subdirectories'))
+        self.sort_by_dir_month_radiobtn.config(text=self.translator.translate('Year-Month/'))
+        self.sort_by_dir_year_radiobtn.config(text=self.translator.translate('Year/'))
+        self.sort_by_dir_year_and_month_radiobtn.config(text=self.translator.translate('Year/Month/'))
+        self.sort_by_dir_none_radiobtn.config(text=self.translator.translate('Do not sort'))
+        self.revert_btn.config(text=self.translator.translate('Revert'))
+        self.start_btn.config(text=self.translator.translate('Start'))
+        self.cancel_btn.config(text=self.translator.translate('Cancel'))
+        self.busy_lbl.config(text=self.translator.translate('App is ready' if not self.busy.get() else 'APP IS BUSY'))
+
+    def on_exit(self):
+        if self.busy.get():
+            tk.messagebox.showinfo(self.translator.translate('Info'), self.translator.translate('Please wait until operation is finished'))
+        else:
+            self.root.destroy()
+
+    def on_open_dir_btn_click(self):
+        self.directory.set(tk.filedialog.askdirectory())
+
+    def on_revert_btn_click(self):
+        if self.directory.get() != '':
+            self.start_job(self.revert_directory_thread, ('revert_planned', 'restored', 'skipped', 'failed'), PhotoSorter(monitor=Monitor(quiet=True)))
+        else:
+            tk.messagebox.showerror(self.translator.translate('Error'), self.translator.translate('Please give directory to process'))
+
+    def revert_directory_thread(self, directory:str):
+        res = self.sorter.revert(directory)
+        if res == 0:
+            self.events.put(('finished', 'Info', 'Revert successful !'))
+        elif res == 1:
+            self.events.put(('finished', 'Error', 'Nothing to revert in this directory'))
+        elif res == 2:
+            self.events.put(('finished', 'Info', 'Operation cancelled'))
+        else:
+            self.events.put(('finished', 'Error', 'An error occurred'))
+
+    def on_start_btn_click(self):
+        if self.directory.get() != '':
+            sorter = PhotoSorter(self.use_gps.get(), self.suffix.get(), SortByDir(self.sort_by_dir.get()), self.fallback_datetime.get(), monitor=Monitor(quiet=True))
+            self.start_job(self.process_directory_thread, ('skipped',), sorter)
+        else:
+            tk.messagebox.showerror(self.translator.translate('Error'), self.translator.translate('Please give directory to process'))
+
+    def process_directory_thread(self, directory:str):
+        try:
+            self.events.put(('total', sum(1 for _ in scan_photos(directory))))
+            for _ in self.sorter.process(directory):
+                self.events.put(('progress', 1))
+        except Exception as e:
+            print(e, file=sys.stderr)
+            self.events.put(('finished', 'Error', 'An error occurred'))
+            return
+        self.events.put(('finished', 'Info', 'Operation cancelled' if self.sorter.cancelled.is_set() else 'Operation successful !'))
+
+    def on_cancel_btn_click(self):
+        if self.sorter is not None:
+            self.sorter.cancel()
+            self.enable_disable(self.cancel_btn, False)
+
+    def on_monitor_event(self, event:str, data:dict):
+        # Called from job threads : only the queue is touched
+        if event == 'revert_planned':
+            self.events.put(('total', data['count']))
+        elif event in self.progress_events:
+            self.events.put(('progress', 1))
+
+    def start_job(self, target, progress_events:tuple, sorter:'PhotoSorter'):
+        """
+        Runs target(directory) in a thread, the Tk main loop being fed by events of self.events.
+        @param progress_events events of the monitor of sorter counting as one more photo handled.
+        """
+        self.enable_disable(self.start_btn, False)
+        self.enable_disable(self.revert_btn, False)
+        self.enable_disable(self.cancel_btn, True)
+        self.busy_lbl.config(bg='red', text=self.translator.translate('APP IS BUSY'))
+        self.busy.set(True)
+        self.sorter = sorter
+        self.progress_events = progress_events
+        sorter.monitor.subscribe(self.on_monitor_event)
+        self.done_count = 0
+        self.total_count = 0
+        self.start_time = time.monotonic()
+        self.update_progress()
+        job = Thread(target=target, args=(self.directory.get(),))
+        job.start()
+        self.root.after(PhotoSorterGui.REFRESH_INTERVAL_MS, self.poll_events)
+
+    def poll_events(self):
+        """
+        Handles all events received since last call, then draws progress once.
+        """
+        finished = None
+        while True:
+            try:
+                event = self.events.get_nowait()
+            except Empty:
+                break
+            if event[0] == 'progress':
+                self.done_count += event[1]
+            elif event[0] == 'total':
+                self.total_count = event[1]
+            elif event[0] == 'finished':
+                finished = event
+        self.update_progress()
+        if finished is None:
+            self.root.after(PhotoSorterGui.REFRESH_INTERVAL_MS, self.poll_events)
+            return
+        self.sorter = None
+        self.enable_disable(self.start_btn, True)
+        self.enable_disable(self.revert_btn, True)
+        self.enable_disable(self.cancel_btn, False)
+        self.busy_lbl.config(bg='green', text=self.translator.translate('App is ready'))
+        self.busy.set(False)
+        _, title, message = finished
+        if title == 'Error':
+            tk.messagebox.showerror(self.translator.translate(title), self.translator.translate(message))
+        else:
+            tk.messagebox.showinfo(self.translator.translate(title), self.translator.translate(message))
+
+    def update_progress(self):
+        self.progress_bar.config(maximum=max(self.total_count, 1), value=min(self.done_count, self.total_count))
+        elapsed = time.monotonic() - self.start_time
+        text = f'{self.done_count} / {self.total_count}'
+        if self.done_count != 0 and elapsed > 0:
+            rate = self.done_count / elapsed
+            remaining = int(max(self.total_count - self.done_count, 0) / rate)
+            text += f' - {rate:.1f} photos/s - ' + self.translator.translate('Remaining time') + f' {remaining // 60}:{remaining % 60:02}'
+        self.progress_lbl.config(text=text)
+
+    def enable_disable(self, element, enabled:bool):
+        element['state'] = tk.NORMAL if enabled else tk.DISABLED
+
+
+################################### Instrumentation ################################################
+
+class Monitor:
+    """
+    Instrumentation of sorting and reverting : counters, time spent per stage with latency histograms,
+    and events sent to subscribers. Messages about each file are printed unless quiet.
+    Time of stages run by several workers is summed over workers.
+    """
+    # Upper bounds of latency histograms buckets, in seconds
+    HISTOGRAM_BOUNDS = (1e-4, 2e-4, 5e-4, 1e-3, 2e-3, 5e-3, 1e-2, 2e-2, 5e-2, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, math.inf)
+
+    def __init__(self, quiet:bool = False) -> None:
+        self.quiet = quiet
+        self.counters = {}
+        # Stage name to [count, total seconds, max seconds, histogram]
+        self.timers = {}
+        self.subscribers = []
+        self.lock = Lock()
+
+    def subscribe(self, callback):
+        """
+        @param callback called as callback(event, data) from the thread emitting the event, see emit.
+        """
+        self.subscribers.append(callback)
+
+    def emit(self, event:str, **data):
+        """
+        Events are 'renamed', 'restored' and 'planned' (old, new), 'failed' (pathname, error), 'skipped' (pathname) for photos
+        left as they are, and 'revert_planned' (count) giving the number of files to restore.
+        """
+        for callback in self.subscribers:
+            callback(event, data)
+
+    def log(self, message:str):
+        if not self.quiet:
+            print(message)
+
+    def error(self, message, pathname:str | None = None):
+        self.count('failures')
+        print(message, file=sys.stderr)
+        self.emit('failed', pathname=pathname, error=str(message))
+
+    def count(self, name:str, value:int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name:str, seconds:float):
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = [0, 0.0, 0.0, [0] * len(Monitor.HISTOGRAM_BOUNDS)]
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+            timer[3][bisect.bisect_left(Monitor.HISTOGRAM_BOUNDS, seconds)] += 1
+
+    @contextmanager
+    def timer(self, name:str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def merge(self, counters:dict, timers:dict):
+        """
+        Adds counters and timers of another monitor, such as one of another process.
+        """
+        with self.lock:
+            for name, value in counters.items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for name, (count, total, maximum, histogram) in timers.items():
+                timer = self.timers.get(name)
+                if timer is None:
+                    timer = self.timers[name] = [0, 0.0, 0.0, [0] * len(Monitor.HISTOGRAM_BOUNDS)]
+                timer[0] += count
+                timer[1] += total
+                timer[2] = max(timer[2], maximum)
+                timer[3] = [a + b for a, b in zip(timer[3], histogram)]
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'stages': {
+                    name: {
+                        'count': count,
+                        'total_seconds': round(total, 6),
+                        'max_seconds': round(maximum, 6),
+                        'histogram': {(f'<={bound * 1000:g}ms' if bound != math.inf else 'more'):bucket for bound, bucket in zip(Monitor.HISTOGRAM_BOUNDS, histogram) if bucket != 0},
+                    }
+                    for name, (count, total, maximum, histogram) in self.timers.items()
+                },
+            }
+
+
+################################### Geocoding ######################################################
+
+class Geocoder:
+    """
+    Base class of reverse geocoders, giving the path-safe (country, town) at given coordinates.
+    """
+    # Maximum number of requests per second, None if unlimited
+    requests_per_second = None
+
+    def reverse(self, latitude:float, longitude:float) -> tuple[str, str]:
+        raise NotImplementedError()
+
+    def key(self, latitude:float, longitude:float):
+        """
+        @return key shared by all coordinates having the same location.
+        """
+        return latitude, longitude
+
+    def peek(self, latitude:float, longitude:float) -> tuple[str, str] | None:
+        """
+        @return location if it is known without any request, None otherwise.
+        """
+        return None
+
+    def save(self):
+        pass
+
+
+class NominatimGeocoder(Geocoder):
+    """
+    Online geocoder using OpenStreetMap, extra arguments are given to geopy Nominatim (domain, scheme...).
+    """
+    # Usage policy of OpenStreetMap
+    requests_per_second = 1.0
+
+    def __init__(self, **kwargs) -> None:
+        from geopy.geocoders import Nominatim
+        self.geolocator = Nominatim(user_agent="photosorter", **kwargs)
+
+    def reverse(self, latitude:float, longitude:float) -> tuple[str, str]:
+        country = ''
+        town = ''
+        # Get full adress
+        location = self.geolocator.reverse(f'{latitude},{longitude}')
+        if location is not None:
+            address = location.raw['address']
+            if 'country' in address:
+                country = address['country']
+            if 'town' in address:
+                town = address['town']
+            elif 'village' in address:
+                town = address['village']
+            elif 'municipality' in address:
+                town = address['municipality']
+        # Make names path-proof
+        return path_safe_name(country), path_safe_name(town)
+
+
+class CachedGeocoder(Geocoder):
+    """
+    Persistent cache of another geocoder, with coordinates quantized to given number of decimals
+    (3 decimals are about 100m). The least recently used entries are dropped above max_entries.
+    """
+    def __init__(self, geocoder:Geocoder, cache_pathname:str | None = None, precision:int = 3, max_entries:int = 100000) -> None:
+        self.geocoder = geocoder
+        self.cache_pathname = cache_pathname
+        self.precision = precision
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.modified = False
+        self.lock = Lock()
+        if cache_pathname is not None and os.path.isfile(cache_pathname):
+            try:
+                with open(cache_pathname) as cache_file:
+                    self.entries.update((key, tuple(value)) for key, value in json.load(cache_file).items())
+            except Exception as e:
+                print(e, file=sys.stderr)
+
+    @property
+    def requests_per_second(self):
+        return self.geocoder.requests_per_second
+
+    def quantize(self, latitude:float, longitude:float) -> tuple[float, float]:
+        return round(latitude, self.precision), round(longitude, self.precision)
+
+    def key(self, latitude:float, longitude:float) -> str:
+        latitude, longitude = self.quantize(latitude, longitude)
+        return f'{latitude:.{self.precision}f},{longitude:.{self.precision}f}'
+
+    def peek(self, latitude:float, longitude:float) -> tuple[str, str] | None:
+        key = self.key(latitude, longitude)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        return None
+
+    def reverse(self, latitude:float, longitude:float) -> tuple[str, str]:
+        location = self.peek(latitude, longitude)
+        if location is not None:
+            return location
+        # Query quantized coordinates such that result does not depend on which photo is seen first
+        key = self.key(latitude, longitude)
+        latitude, longitude = self.quantize(latitude, longitude)
+        location = self.geocoder.reverse(latitude, longitude)
+        with self.lock:
+            self.entries[key] = location
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.modified = True
+        return location
+
+    def save(self):
+        self.geocoder.save()
+        if self.cache_pathname is None or not self.modified:
+            return
+        with self.lock:
+            os.makedirs(os.path.dirname(self.cache_pathname), exist_ok=True)
+            # Write then replace such that an interrupted save does not corrupt the cache
+            # Unique per process, as processes of process_roots share the cache
+            temporary_pathname = f'{self.cache_pathname}.{os.getpid()}.tmp'
+            with open(temporary_pathname, 'w') as cache_file:
+                json.dump(self.entries, cache_file)
+            os.replace(temporary_pathname, self.cache_pathname)
+            self.modified = False
+
+
+class GazetteerGeocoder(Geocoder):
+    """
+    Offline geocoder using a GeoNames-like file of places (tab separated name, latitude, longitude, country code
+    as in cities1000.txt) and optionally a GeoNames countryInfo.txt file to get country names instead of codes.
+    Places are indexed in a grid of GAZETTEER_CELLS_PER_DEGREE cells per degree, built once and memory-mapped.
+    """
+    INDEX_MAGIC = b'PSGZ'
+    INDEX_VERSION = 1
+    # magic, version, byte order, source size, source mtime, places count, names blob size, countries blob size
+    INDEX_HEADER = struct.Struct('<4sIIQQIII')
+    CELLS_PER_DEGREE = 2
+    LATITUDE_CELLS = 180 * CELLS_PER_DEGREE
+    LONGITUDE_CELLS = 360 * CELLS_PER_DEGREE
+    KM_PER_DEGREE = 111.2
+
+    def __init__(self, gazetteer_pathname:str, countries_pathname:str | None = None, index_pathname:str | None = None, max_distance_km:float = 30.0) -> None:
+        self.max_distance_km = max_distance_km
+        if index_pathname is None:
+            index_pathname = os.path.join(user_cache_directory(), 'gazetteer-' + os.path.basename(gazetteer_pathname) + '.idx')
+        source_stat = os.stat(gazetteer_pathname)
+        if not self.load_index(index_pathname, source_stat):
+            self.build_index(gazetteer_pathname, countries_pathname, index_pathname, source_stat)
+            if not self.load_index(index_pathname, source_stat):
+                raise ValueError('Cannot load gazetteer index ' + index_pathname)
+
+    @classmethod
+    def cell_of(cls, latitude:float, longitude:float) -> tuple[int, int]:
+        row = min(int((latitude + 90) * cls.CELLS_PER_DEGREE), cls.LATITUDE_CELLS - 1)
+        column = int((longitude + 180) * cls.CELLS_PER_DEGREE) % cls.LONGITUDE_CELLS
+        return row, column
+
+    @classmethod
+    def build_index(cls, gazetteer_pathname:str, countries_pathname:str | None, index_pathname:str, source_stat:os.stat_result):
+        country_names = {}
+        if countries_pathname is not None:
+            with open(countries_pathname, encoding='utf-8') as countries_file:
+                for line in countries_file:
+                    if line.startswith('#'):
+                        continue
+                    columns = line.rstrip('\n').split('\t')
+                    if len(columns) > 4:
+                        country_names[columns[0]] = columns[4]
+        # (cell, latitude, longitude, name, country)
+        places = []
+        with open(gazetteer_pathname, encoding='utf-8') as gazetteer_file:
+            for line in gazetteer_file:
+                columns = line.rstrip('\n').split('\t')
+                # Keep only populated places when feature class is given
+                if len(columns) < 9 or (columns[6] != '' and columns[6] != 'P'):
+                    continue
+                try:
+                    latitude, longitude = float(columns[4]), float(columns[5])
+                except ValueError:
+                    continue
+                row, column = cls.cell_of(latitude, longitude)
+                places.append((row * cls.LONGITUDE_CELLS + column, latitude, longitude, columns[1], country_names.get(columns[8], columns[8])))
+        places.sort()
+        countries = sorted(set(place[4] for place in places))
+        country_indices = {country:index for index, country in enumerate(countries)}
+        # Flat arrays, each place is found through the first place index of its cell
+        cell_starts = array('i', [0]) * (cls.LATITUDE_CELLS * cls.LONGITUDE_CELLS + 1)
+        for place in places:
+            cell_starts[place[0] + 1] += 1
+        for cell in range(1, len(cell_starts)):
+            cell_starts[cell] += cell_starts[cell - 1]
+        latitudes = array('f', (place[1] for place in places))
+        longitudes = array('f', (place[2] for place in places))
+        place_countries = array('i', (country_indices[place[4]] for place in places))
+        names = bytearray()
+        name_offsets = array('i', [0])
+        for place in places:
+            names += place[3].encode('utf-8')
+            name_offsets.append(len(names))
+        countries_blob = '\n'.join(countries).encode('utf-8')
+        os.makedirs(os.path.dirname(os.path.abspath(index_pathname)), exist_ok=True)
+        temporary_pathname = f'{index_pathname}.{os.getpid()}.tmp'
+        with open(temporary_pathname, 'wb') as index_file:
+            index_file.write(cls.INDEX_HEADER.pack(cls.INDEX_MAGIC, cls.INDEX_VERSION, sys.byteorder == 'little', source_stat.st_size, source_stat.st_mtime_ns, len(places), len(names), len(countries_blob)))
+            for values in (cell_starts, latitudes, longitudes, place_countries, name_offsets):
+                values.tofile(index_file)
+            index_file.write(names)
+            index_file.write(countries_blob)
+        os.replace(temporary_pathname, index_pathname)
+
+    def load_index(self, index_pathname:str, source_stat:os.stat_result) -> bool:
+        """
+        @return False if the index is absent, outdated, truncated or corrupt.
+        """
+        if not os.path.isfile(index_pathname):
+            return False
+        with open(index_pathname, 'rb') as index_file:
+            try:
+                self.index = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty file
+                return False
+        try:
+            views = self.map_index(source_stat)
+        except (struct.error, TypeError, ValueError):
+            views = None
+        # Views of a failed mapping are released once out of the except clause, allowing to close the map
+        if views is None:
+            self.index.close()
+            return False
+        self.cell_starts, self.latitudes, self.longitudes, self.place_countries, self.name_offsets, self.names, self.countries = views
+        return True
+
+    def map_index(self, source_stat:os.stat_result) -> tuple | None:
+        """
+        @return views on the arrays of the mapped index, None if it does not match the source.
+        """
+        magic, version, little_endian, source_size, source_mtime_ns, places_count, names_size, countries_size = GazetteerGeocoder.INDEX_HEADER.unpack_from(self.index)
+        cells_size = 4 * (GazetteerGeocoder.LATITUDE_CELLS * GazetteerGeocoder.LONGITUDE_CELLS + 1)
+        expected_size = GazetteerGeocoder.INDEX_HEADER.size + cells_size + 4 * (4 * places_count + 1) + names_size + countries_size
+        if magic != GazetteerGeocoder.INDEX_MAGIC or version != GazetteerGeocoder.INDEX_VERSION or little_endian != (sys.byteorder == 'little') \
+                or source_size != source_stat.st_size or source_mtime_ns != source_stat.st_mtime_ns or len(self.index) != expected_size:
+            return None
+        # Views on the mapped file, nothing is copied
+        view = memoryview(self.index)
+        offset = GazetteerGeocoder.INDEX_HEADER.size
+        def next_view(size:int, format:str | None = None) -> memoryview:
+            nonlocal offset
+            result = view[offset:offset + size]
+            offset += size
+            return result.cast(format) if format is not None else result
+        return (next_view(cells_size, 'i'), next_view(4 * places_count, 'f'), next_view(4 * places_count, 'f'), next_view(4 * places_count, 'i'),
+                next_view(4 * (places_count + 1), 'i'), next_view(names_size), bytes(next_view(countries_size)).decode('utf-8').split('\n'))
+
+    def nearest_place(self, latitude:float, longitude:float) -> int | None:
+        """
+        @return index of the nearest place within max_distance_km, None if there is none.
+        """
+        row, column = GazetteerGeocoder.cell_of(latitude, longitude)
+        # Distances are computed in degrees of latitude, longitudes being shrunk by the cosine of latitude
+        longitude_scale = max(math.cos(math.radians(latitude)), 1e-3)
+        max_distance = self.max_distance_km / GazetteerGeocoder.KM_PER_DEGREE
+        best_index = None
+        best_distance = max_distance
+        radius = 0
+        # Explore rings of cells around the cell of the point until no closer place can be found
+        while (radius - 1) * longitude_scale / GazetteerGeocoder.CELLS_PER_DEGREE <= best_distance and radius <= GazetteerGeocoder.LONGITUDE_CELLS // 2:
+            for ring_row in range(row - radius, row + radius + 1):
+                if ring_row < 0 or ring_row >= GazetteerGeocoder.LATITUDE_CELLS:
+                    continue
+                step = 1 if abs(ring_row - row) == radius else 2 * radius
+                for ring_column in range(column - radius, column + radius + 1, max(step, 1)):
+                    cell = ring_row * GazetteerGeocoder.LONGITUDE_CELLS + ring_column % GazetteerGeocoder.LONGITUDE_CELLS
+                    for index in range(self.cell_starts[cell], self.cell_starts[cell + 1]):
+                        delta_longitude = (self.longitudes[index] - longitude + 180) % 360 - 180
+                        distance = math.hypot(self.latitudes[index] - latitude, delta_longitude * longitude_scale)
+                        if distance <= best_distance:
+                            best_index = index
+                            best_distance = distance
+            radius += 1
+        return best_index
+
+    def reverse(self, latitude:float, longitude:float) -> tuple[str, str]:
+        index = self.nearest_place(latitude, longitude)
+        if index is None:
+            return '', ''
+        town = bytes(self.names[self.name_offsets[index]:self.name_offsets[index + 1]]).decode('utf-8')
+        return path_safe_name(self.countries[self.place_countries[index]]), path_safe_name(town)
+
+
+class GeocodingScheduler:
+    """
+    Resolves locations in background workers. Coordinates sharing the same geocoder key are queried once,
+    at most requests_per_second times per second, and failed requests are retried with exponential backoff.
+    Once cancel is set, waiting requests are abandoned.
+    """
+    def __init__(self, geocoder:Geocoder, requests_per_second:float | None = None, workers:int = 4, max_retries:int = 3, backoff:float = 1.0, monitor:Monitor | None = None,
+                 cancel:Event | None = None) -> None:
+        self.geocoder = geocoder
+        self.cancel = cancel if cancel is not None else Event()
+        self.monitor = monitor if monitor is not None else Monitor()
+        self.requests_per_second = requests_per_second if requests_per_second is not None else geocoder.requests_per_second
+        self.max_retries = max_retries
+        self.backoff = backoff
+        from concurrent.futures import ThreadPoolExecutor
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.futures = {}
+        self.lock = Lock()
+        self.next_request_time = time.monotonic()
+
+    def submit(self, latitude:float, longitude:float):
+        """
+        @return concurrent.futures.Future of the (country, town) at given coordinates.
+        """
+        from concurrent.futures import Future
+        key = self.geocoder.key(latitude, longitude)
+        with self.lock:
+            if key in self.futures:
+                self.monitor.count('geocoder_cache_hits')
+                return self.futures[key]
+            location = self.geocoder.peek(latitude, longitude)
+            if location is not None:
+                self.monitor.count('geocoder_cache_hits')
+                future = Future()
+                future.set_result(location)
+            else:
+                self.monitor.count('geocoder_cache_misses')
+                future = self.executor.submit(self.resolve, latitude, longitude)
+            self.futures[key] = future
+            return future
+
+    def wait(self, delay:float):
+        """
+        Waits for given delay, raising concurrent.futures.CancelledError as soon as cancelled.
+        """
+        if self.cancel.wait(max(delay, 0)):
+            from concurrent.futures import CancelledError
+            raise CancelledError()
+
+    def wait_for_request_slot(self):
+        if not self.requests_per_second:
+            self.wait(0)
+            return
+        # Book the next free slot, then wait for it outside of the lock
+        with self.lock:
+            now = time.monotonic()
+            request_time = max(now, self.next_request_time)
+            self.next_request_time = request_time + 1.0 / self.requests_per_second
+        self.wait(request_time - now)
+
+    def resolve(self, latitude:float, longitude:float) -> tuple[str, str]:
+        for attempt in range(self.max_retries + 1):
+            self.wait_for_request_slot()
+            try:
+                with self.monitor.timer('geocode'):
+                    return self.geocoder.reverse(latitude, longitude)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                self.monitor.count('geocoding_retries')
+                print(f'Geocoding failed ({e}), retrying', file=sys.stderr)
+                self.wait(self.backoff * 2**attempt)
+
+    def close(self):
+        # Requests still queued are not sent once cancelled
+        self.executor.shutdown(wait=True, cancel_futures=self.cancel.is_set())
+
+
+def user_cache_directory() -> str:
+    if sys.platform == 'win32':
+        base_dir = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+    elif sys.platform == 'darwin':
+        base_dir = os.path.expanduser(os.path.join('~', 'Library', 'Caches'))
+    else:
+        base_dir = os.environ.get('XDG_CACHE_HOME', os.path.expanduser(os.path.join('~', '.cache')))
+    return os.path.join(base_dir, 'photosorter')
+
+
+def default_geocoder(use_cache:bool=True, precision:int=3, gazetteer_pathname:str | None = None, countries_pathname:str | None = None) -> Geocoder:
+    # Offline lookups are as fast as the cache itself
+    if gazetteer_pathname is not None:
+        return GazetteerGeocoder(gazetteer_pathname, countries_pathname)
+    geocoder = NominatimGeocoder()
+    if use_cache:
+        geocoder = CachedGeocoder(geocoder, os.path.join(user_cache_directory(), GEOCODING_CACHE_FILENAME), precision)
+    return geocoder
+
+
+################################### Metadata index #################################################
+
+class MetadataIndex:
+    """
+    Persistent metadata of the photos of a directory, such that unchanged photos are not read again.
+    A photo is unchanged if its path, size, modification time and inode are the same.
+    """
+    SCHEMA_VERSION = 3
+
+    def __init__(self, pathname:str, read_only:bool=False) -> None:
+        """
+        @param read_only whether the index is only looked up, such as when planning. It must then exist,
+        and is ignored if of another schema version. Otherwise, the index and its directory are created on first write.
+        """
+        self.pathname = pathname
+        self.read_only = read_only
+        self.lock = Lock()
+        # Accessed by workers of process_directory, under self.lock
+        self.connection = None
+        if read_only:
+            import sqlite3
+            from urllib.request import pathname2url
+            self.connection = sqlite3.connect('file:' + pathname2url(os.path.abspath(pathname)) + '?mode=ro', uri=True, check_same_thread=False)
+            if self.connection.execute('PRAGMA user_version').fetchone()[0] != MetadataIndex.SCHEMA_VERSION:
+                self.connection.close()
+                self.connection = None
+            return
+        if os.path.isfile(pathname):
+            self.connect()
+
+    def connect(self):
+        """
+        Opens the index, creating it if needed, but not the directory it indexes.
+        """
+        import sqlite3
+        try:
+            os.mkdir(os.path.dirname(self.pathname))
+        except FileExistsError:
+            pass
+        self.connection = sqlite3.connect(self.pathname, check_same_thread=False)
+        if self.connection.execute('PRAGMA user_version').fetchone()[0] != MetadataIndex.SCHEMA_VERSION:
+            self.connection.execute('DROP TABLE IF EXISTS photos')
+            self.connection.execute('PRAGMA user_version = ' + str(MetadataIndex.SCHEMA_VERSION))
+        # EXIF dates are NULL if absent from metadata, latitude and longitude are NULL if not read or absent,
+        # country and town are NULL until resolved
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS photos (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, '
+            'date_original TEXT, date_digitized TEXT, date_time TEXT, subsec REAL, gps_read INTEGER, latitude REAL, longitude REAL, country TEXT, town TEXT) WITHOUT ROWID'
+        )
+
+    def get(self, photo_pathname:str, stat:os.stat_result) -> PhotoInfo | None:
+        """
+        @return metadata of given photo if it is unchanged since it was indexed, None otherwise.
+        """
+        if self.connection is None:
+            return None
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT date_original, date_digitized, date_time, subsec, gps_read, latitude, longitude, country, town FROM photos WHERE path = ? AND size = ? AND mtime_ns = ? AND inode = ?',
+                (photo_pathname, stat.st_size, stat.st_mtime_ns, stat.st_ino)
+            ).fetchone()
+        if row is None:
+            return None
+        *exif_date_times, subsec, gps_read, latitude, longitude, country, town = row
+        photo_info = PhotoInfo(photo_pathname, None, True, latitude, longitude)
+        photo_info.exif_date_times = tuple(datetime.fromisoformat(date_time) if date_time is not None else None for date_time in exif_date_times)
+        photo_info.subsec = subsec
+        photo_info.gps_read = bool(gps_read)
+        photo_info.country = country
+        photo_info.town = town
+        return photo_info
+
+    def put(self, photo_info:PhotoInfo, stat:os.stat_result):
+        if self.read_only:
+            return
+        with self.lock:
+            if self.connection is None:
+                self.connect()
+            self.connection.execute(
+                'INSERT OR REPLACE INTO photos VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (photo_info.pathname, stat.st_size, stat.st_mtime_ns, stat.st_ino,
+                 *(date_time.isoformat(' ') if date_time is not None else None for date_time in photo_info.exif_date_times),
+                 photo_info.subsec, photo_info.gps_read, photo_info.latitude, photo_info.longitude, photo_info.country, photo_info.town)
+            )
+
+    def set_location(self, photo_pathname:str, country:str, town:str):
+        if self.read_only:
+            return
+        with self.lock:
+            # Nothing indexed yet
+            if self.connection is None:
+                return
+            self.connection.execute('UPDATE photos SET country = ?, town = ? WHERE path = ?', (country, town, photo_pathname))
+
+    def rename(self, old_pathname:str, new_pathname:str):
+        # Renaming keeps size, modification time and inode
+        if self.read_only:
+            return
+        with self.lock:
+            if self.connection is None:
+                return
+            self.connection.execute('DELETE FROM photos WHERE path = ?', (new_pathname,))
+            self.connection.execute('UPDATE photos SET path = ? WHERE path = ?', (new_pathname, old_pathname))
+
+    def close(self):
+        with self.lock:
+            if self.connection is None:
+                return
+            self.connection.commit()
+            self.connection.close()
+            self.connection = None
+
+
+################################### Journal ########################################################
+
+def journal_path(pathname:str, directory:str) -> str:
+    """
+    @return pathname relative to directory if it is inside, absolute pathname otherwise.
+    """
+    try:
+        relative_pathname = os.path.relpath(pathname, directory)
+    except ValueError:
+        # Different drives on windows
+        return pathname
+    return pathname if relative_pathname.startswith(os.pardir) else relative_pathname
+
+
+class RenameJournal:
+    """
+    Append-only report of the files renamed in a directory, written in PHOTOSORTER_SUBDIR as one JSON record per line :
+    a header, one record per renamed file, and a footer once finished.
+    Each record is flushed to the operating system at once, such that a killed run can still be reverted,
+    and synced to disk every sync_count records or sync_interval seconds against power losses. The file is created on first record.
+    """
+    def __init__(self, directory:str, sync_count:int = 1000, sync_interval:float = 1.0) -> None:
+        self.directory = os.path.abspath(directory)
+        self.sync_count = sync_count
+        self.sync_interval = sync_interval
+        self.file = None
+        self.pathname = None
+        self.renamed_count = 0
+        self.unsynced_count = 0
+        self.last_sync_time = time.monotonic()
+
+    def open(self):
+        photosorter_dir = os.path.join(self.directory, PHOTOSORTER_SUBDIR)
+        os.makedirs(photosorter_dir, exist_ok=True)
+        report_number = max((int(REPORT_FILENAME_PATTERN.fullmatch(filename).group(1)) for filename in report_filenames(photosorter_dir)), default=0) + 1
+        self.pathname = os.path.join(photosorter_dir, f'{report_number}.jsonl')
+        self.file = open(self.pathname, 'x', encoding='utf-8', buffering=1024*1024)
+        self.write({'type':'header', 'version':JOURNAL_VERSION, 'directory':self.directory, 'started':datetime.now().isoformat()})
+
+    def write(self, record:dict):
+        self.file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced_count = 0
+        self.last_sync_time = time.monotonic()
+
+    def record(self, old_pathname:str, new_pathname:str, sync:bool=False):
+        """
+        @param sync whether the record is synced to disk at once, such as before removing the source of a copy.
+        """
+        if self.file is None:
+            self.open()
+        self.write({'type':'rename', 'old':journal_path(old_pathname, self.directory), 'new':journal_path(new_pathname, self.directory)})
+        self.renamed_count += 1
+        self.unsynced_count += 1
+        self.file.flush()
+        if sync or self.unsynced_count >= self.sync_count or time.monotonic() - self.last_sync_time >= self.sync_interval:
+            self.sync()
+
+    def close(self):
+        if self.file is None:
+            return
+        self.write({'type':'footer', 'renamed':self.renamed_count, 'finished':datetime.now().isoformat()})
+        self.sync()
+        self.file.close()
+        self.file = None
+
+
+def read_report(report_pathname:str, directory:str):
+    """
+    Yields (old pathname, new pathname) of each file renamed according to given report, in order of renaming.
+    Reports of older versions (N.json) are supported, and truncated lines of interrupted journals are skipped.
+    @param directory where the report was written, relative pathnames are relative to it.
+    """
+    if report_pathname.endswith('.json'):
+        with open(report_pathname) as json_file:
+            for picture_names in json.load(json_file).values():
+                yield picture_names['OldName'], picture_names['NewName']
+        return
+    with open(report_pathname, encoding='utf-8') as journal_file:
+        for line in journal_file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Last line of an interrupted run
+                print('Skipping truncated record of ' + report_pathname, file=sys.stderr)
+                continue
+            if record.get('type') == 'rename':
+                yield os.path.join(directory, record['old']), os.path.join(directory, record['new'])
+
+
+################################### Watch ##########################################################
+
+class PollingWatcher:
+    """
+    Finds files added to a directory by comparing the modification times, then the entries, of its subdirectories
+    every interval seconds. Works on every file system, network ones included.
+    """
+    def __init__(self, directory:str, recursive:bool, scan_filter:'ScanFilter', interval:float = WATCH_POLL_INTERVAL) -> None:
+        self.recursive = recursive
+        self.scan_filter = scan_filter
+        self.interval = interval
+        # Directory to (mtime_ns, names of its entries)
+        self.directories = {}
+        self.add(os.path.abspath(directory))
+
+    def add(self, directory:str) -> list[str]:
+        """
+        Starts watching given directory.
+        @return pathnames of the files it contains.
+        """
+        self.directories[directory] = (None, set())
+        return self.refresh(directory)
+
+    def refresh(self, directory:str) -> list[str]:
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+            if mtime_ns == self.directories[directory][0]:
+                return []
+            with os.scandir(directory) as entries:
+                entries = list(entries)
+        except OSError:
+            # Removed
+            del self.directories[directory]
+            return []
+        known_names = self.directories[directory][1]
+        self.directories[directory] = (mtime_ns, {entry.name for entry in entries})
+        added = []
+        for entry in entries:
+            if entry.name in known_names:
+                continue
+            try:
+                if entry.is_file():
+                    added.append(entry.path)
+                elif self.recursive and entry.is_dir(follow_symlinks=False) and self.scan_filter.is_subdirectory(entry.name, entry.path):
+                    added.extend(self.add(entry.path))
+            except OSError:
+                pass
+        return added
+
+    def wait(self, timeout:float) -> list[str]:
+        """
+        @return pathnames of files created or moved in since last call, after at most about timeout seconds.
+        """
+        time.sleep(min(timeout, self.interval))
+        added = []
+        for directory in list(self.directories):
+            added.extend(self.refresh(directory))
+        return added
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """
+    Finds files written or moved into a directory using Linux inotify, without polling.
+    """
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_ISDIR = 0x40000000
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, directory:str, recursive:bool, scan_filter:'ScanFilter') -> None:
+        import ctypes
+        # Symbols of the C library linked to the interpreter, AttributeError if not Linux
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.inotify_add_watch = self.libc.inotify_add_watch
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.get_errno = ctypes.get_errno
+        self.directory = os.path.abspath(directory)
+        self.recursive = recursive
+        self.scan_filter = scan_filter
+        # Watch descriptor to directory
+        self.directories = {}
+        self.add(self.directory)
+
+    def add(self, directory:str) -> list[str]:
+        """
+        Starts watching given directory and its subdirectories if recursive.
+        @return pathnames of the files they contain, possibly created before being watched.
+        """
+        wd = self.inotify_add_watch(self.fd, os.fsencode(directory), InotifyWatcher.IN_CLOSE_WRITE | InotifyWatcher.IN_MOVED_TO | InotifyWatcher.IN_CREATE)
+        if wd < 0:
+            raise OSError(self.get_errno(), 'Cannot watch ' + directory)
+        self.directories[wd] = directory
+        added = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    added.append(entry.path)
+                elif self.recursive and entry.is_dir(follow_symlinks=False) and self.scan_filter.is_subdirectory(entry.name, entry.path):
+                    added.extend(self.add(entry.path))
+        return added
+
+    def wait(self, timeout:float) -> list[str]:
+        """
+        @return pathnames of files written or moved in since last call, after at most timeout seconds.
+        """
+        import select
+        if len(select.select([self.fd], [], [], timeout)[0]) == 0:
+            return []
+        added = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return added
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = InotifyWatcher.EVENT_HEADER.unpack_from(data, offset)
+                offset += InotifyWatcher.EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].split(b'\0', 1)[0])
+                offset += length
+                if mask & InotifyWatcher.IN_Q_OVERFLOW:
+                    # Events were lost, hence every photo is a candidate, excluded directories being still skipped
+                    added.extend(scan_photos(self.directory, self.recursive, self.scan_filter.include, self.scan_filter.exclude))
+                    continue
+                directory = self.directories.get(wd)
+                if directory is None:
+                    continue
+                pathname = os.path.join(directory, name)
+                if mask & InotifyWatcher.IN_ISDIR:
+                    if self.recursive and self.scan_filter.is_subdirectory(name, pathname):
+                        try:
+                            added.extend(self.add(pathname))
+                        except OSError as e:
+                            print(e, file=sys.stderr)
+                elif not mask & InotifyWatcher.IN_CREATE:
+                    # A created file is found once closed
+                    added.append(pathname)
+
+    def close(self):
+        os.close(self.fd)
+
+
+def open_directory_watcher(directory:str, recursive:bool=False, scan_filter:'ScanFilter | None' = None, poll_interval:float | None = None):
+    """
+    @param poll_interval if given, directory is polled with this interval instead of using inotify.
+    @return an InotifyWatcher if available, a PollingWatcher otherwise.
+    """
+    if scan_filter is None:
+        scan_filter = ScanFilter(directory)
+    if poll_interval is None and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(directory, recursive, scan_filter)
+        except (AttributeError, OSError) as e:
+            print(f'Cannot use inotify ({e}), polling instead', file=sys.stderr)
+    return PollingWatcher(directory, recursive, scan_filter, poll_interval if poll_interval is not None else WATCH_POLL_INTERVAL)
+
+
+################################### Methods ########################################################
+
+def start_gui():
+    global tk
+    import tkinter as tk
+    import tkinter.filedialog
+    import tkinter.messagebox
+    import tkinter.ttk
+    print("Starting GUI...")
+    PhotoSorterGui()
+    print("GUI closed.")
+
+
+def path_safe_name(name:str):
+    # Remove accents on letters
+    import unidecode
+    result = unidecode.unidecode(name)
+    # Choose first name in case of two choices 'NameA / NameB'
+    result = result.split('/')[0]
+    # Remove unwanted characters
+    for char in ':, &$%!?#{}<>*\'\"@+`|=\\/':
+        result = result.replace(char, '')
+    return result
+
+
+# Tags read from EXIF data, per IFD, using exifread naming
+EXIF_IFD0_TAGS = {0x0132:'Image DateTime'}
+EXIF_GPS_TAGS = {0x0001:'GPS GPSLatitudeRef', 0x0002:'GPS GPSLatitude', 0x0003:'GPS GPSLongitudeRef', 0x0004:'GPS GPSLongitude'}
+EXIF_SUBIFD_TAGS = {0x9003:'EXIF DateTimeOriginal', 0x9004:'EXIF DateTimeDigitized', 0x9291:'EXIF SubSecTimeOriginal'}
+EXIF_GPS_IFD_POINTER = 0x8825
+EXIF_SUBIFD_POINTER = 0x8769
+# Size in bytes of each TIFF type used by above tags
+TIFF_TYPE_SIZES = {1:1, 2:1, 3:2, 4:4, 5:8, 7:1, 9:4, 10:8}
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# Dates of ISOBMFF files (mp4, mov, heic) are seconds since this UTC date
+ISOBMFF_EPOCH = datetime(1904, 1, 1, tzinfo=timezone.utc)
+# Types of first box of ISOBMFF files, older QuickTime files not starting with ftyp
+ISOBMFF_FIRST_BOXES = (b'ftyp', b'moov', b'mdat', b'wide', b'free')
+# Upper bound of metadata boxes and items read in memory
+MAX_METADATA_SIZE = 1024 * 1024
+
+
+def parse_tiff_tags(tiff:bytes, use_gps:bool=True) -> dict:
+    """
+    Decodes only the tags of EXIF_IFD0_TAGS, EXIF_SUBIFD_TAGS and EXIF_GPS_TAGS from a TIFF block.
+    @return dict of tag name to value : str for ASCII tags, tuple of floats for RATIONAL tags.
+    """
+    byte_order = {b'II':'<', b'MM':'>'}[tiff[0:2]]
+    result = {}
+    sub_ifd_offsets = {}
+
+    def read_ifd(offset:int, wanted:dict, wanted_pointers:set):
+        remaining = set(wanted) | wanted_pointers
+        entries_count, = struct.unpack_from(byte_order + 'H', tiff, offset)
+        for k in range(entries_count):
+            # Stop reading as soon as all wanted tags are found
+            if not remaining:
+                break
+            entry_offset = offset + 2 + 12*k
+            tag, tag_type, count, value_offset = struct.unpack_from(byte_order + 'HHII', tiff, entry_offset)
+            if tag not in remaining:
+                continue
+            remaining.discard(tag)
+            if tag in wanted_pointers:
+                sub_ifd_offsets[tag] = value_offset
+                continue
+            if tag_type not in TIFF_TYPE_SIZES:
+                continue
+            # Values of 4 bytes or less are stored in the entry itself
+            size = TIFF_TYPE_SIZES[tag_type] * count
+            value_start = entry_offset + 8 if size <= 4 else value_offset
+            raw = tiff[value_start:value_start + size]
+            if len(raw) != size:
+                raise ValueError('Truncated EXIF data')
+            if tag_type == 2:
+                result[wanted[tag]] = raw.split(b'\0', 1)[0].decode('ascii', 'replace').strip()
+            elif tag_type in (5, 10):
+                fractions = struct.unpack(byte_order + ('I' if tag_type == 5 else 'i')*2*count, raw)
+                result[wanted[tag]] = tuple(fractions[2*i] / fractions[2*i+1] if fractions[2*i+1] != 0 else 0.0 for i in range(count))
+
+    ifd0_offset, = struct.unpack_from(byte_order + 'I', tiff, 4)
+    read_ifd(ifd0_offset, EXIF_IFD0_TAGS, {EXIF_SUBIFD_POINTER, EXIF_GPS_IFD_POINTER} if use_gps else {EXIF_SUBIFD_POINTER})
+    if EXIF_SUBIFD_POINTER in sub_ifd_offsets:
+        read_ifd(sub_ifd_offsets[EXIF_SUBIFD_POINTER], EXIF_SUBIFD_TAGS, set())
+    if EXIF_GPS_IFD_POINTER in sub_ifd_offsets:
+        read_ifd(sub_ifd_offsets[EXIF_GPS_IFD_POINTER], EXIF_GPS_TAGS, set())
+    return result
+
+
+def read_jpeg_exif_block(file) -> bytes | None:
+    """
+    Walks JPEG segments headers up to the EXIF APP1 segment, without reading image data.
+    @return TIFF block of EXIF APP1 segment, None if absent.
+    """
+    if file.read(2) != b'\xff\xd8':
+        raise ValueError('Not a JPEG file')
+    while True:
+        marker = file.read(2)
+        if len(marker) != 2 or marker[0] != 0xFF:
+            return None
+        # Start of scan or end of image : no more metadata
+        if marker[1] in (0xDA, 0xD9):
+            return None
+        length_bytes = file.read(2)
+        if len(length_bytes) != 2:
+            return None
+        length, = struct.unpack('>H', length_bytes)
+        # Length includes its own 2 bytes, a smaller one would read or seek backwards
+        if length < 2:
+            raise ValueError('Invalid JPEG segment length')
+        if marker[1] == 0xE1:
+            # Segments are at most 64kB, hence this read is bounded
+            segment = file.read(length - 2)
+            if segment[0:6] == b'Exif\0\0':
+                return segment[6:]
+        else:
+            file.seek(length - 2, os.SEEK_CUR)
+
+
+def utc_to_exif_datetime(date_time:datetime) -> str | None:
+    """
+    @return local date and time of given UTC date formatted as in EXIF, None if it cannot be represented.
+    """
+    try:
+        return date_time.astimezone().strftime('%Y:%m:%d %H:%M:%S')
+    except (ValueError, OverflowError, OSError):
+        return None
+
+
+def read_png_metadata(file) -> tuple[bytes | None, dict]:
+    """
+    Walks PNG chunks headers up to eXIf and tIME chunks, seeking over image data.
+    @return TIFF block of eXIf chunk or None, and tIME date as 'Image DateTime' tag.
+    """
+    if file.read(8) != PNG_SIGNATURE:
+        raise ValueError('Not a PNG file')
+    tiff = None
+    tags = {}
+    while tiff is None or not tags:
+        header = file.read(8)
+        if len(header) != 8:
+            break
+        length, chunk_type = struct.unpack('>I4s', header)
+        if chunk_type == b'IEND':
+            break
+        if chunk_type == b'eXIf' and length <= MAX_METADATA_SIZE:
+            tiff = file.read(length)
+            length = 0
+        elif chunk_type == b'tIME' and length == 7:
+            year, month, day, hour, minute, second = struct.unpack('>HBBBBB', file.read(7))
+            length = 0
+            try:
+                # Date of last modification of image, in UTC
+                date_time = utc_to_exif_datetime(datetime(year, month, day, hour, minute, min(second, 59), tzinfo=timezone.utc))
+            except ValueError:
+                date_time = None
+            if date_time is not None:
+                tags['Image DateTime'] = date_time
+        # Skip data and CRC
+        file.seek(length + 4, os.SEEK_CUR)
+    return tiff, tags
+
+
+def iterate_boxes(file, start:int, end:int):
+    """
+    Walks ISOBMFF boxes headers from start to end offsets of file, seeking over their content.
+    @return generator of box type, content start and end offsets.
+    """
+    position = start
+    while position + 8 <= end:
+        file.seek(position)
+        header = file.read(8)
+        if len(header) != 8:
+            return
+        size, box_type = struct.unpack('>I4s', header)
+        content_start = position + 8
+        if size == 1:
+            size, = struct.unpack('>Q', file.read(8))
+            content_start += 8
+        elif size == 0:
+            # Box extending to end of file
+            size = end - position
+        if position + size < content_start:
+            raise ValueError('Invalid ISOBMFF box size')
+        yield box_type, content_start, min(position + size, end)
+        position += size
+
+
+def read_box(file, start:int, end:int) -> bytes:
+    if end - start > MAX_METADATA_SIZE:
+        raise ValueError('ISOBMFF box too large')
+    file.seek(start)
+    return file.read(end - start)
+
+
+def read_uint(data:bytes, position:int, size:int) -> tuple[int, int]:
+    """
+    @return big-endian unsigned integer of size bytes at position, and position after it.
+    """
+    if position + size > len(data):
+        raise ValueError('Truncated ISOBMFF box')
+    return int.from_bytes(data[position:position + size], 'big'), position + size
+
+
+def find_heif_exif_extent(iinf:bytes, iloc:bytes) -> tuple[int, int] | None:
+    """
+    Looks for the Exif item in contents of iinf (item information) and iloc (item location) boxes.
+    @return file offset and length of Exif item, None if absent.
+    """
+    version = iinf[0]
+    count, position = read_uint(iinf, 4, 2 if version == 0 else 4)
+    exif_item_id = None
+    for _ in range(count):
+        size, _ = read_uint(iinf, position, 4)
+        if size < 8:
+            raise ValueError('Invalid ISOBMFF box size')
+        # Item type is present from version 2 of infe boxes
+        if iinf[position + 4:position + 8] == b'infe' and position + 8 < len(iinf) and iinf[position + 8] >= 2:
+            item_id, type_position = read_uint(iinf, position + 12, 2 if iinf[position + 8] == 2 else 4)
+            if iinf[type_position + 2:type_position + 6] == b'Exif':
+                exif_item_id = item_id
+                break
+        position += size
+    if exif_item_id is None:
+        return None
+
+    version = iloc[0]
+    offset_size, length_size = iloc[4] >> 4, iloc[4] & 0xF
+    base_offset_size, index_size = iloc[5] >> 4, iloc[5] & 0xF if version in (1, 2) else 0
+    id_size = 2 if version < 2 else 4
+    count, position = read_uint(iloc, 6, id_size)
+    for _ in range(count):
+        item_id, position = read_uint(iloc, position, id_size)
+        construction_method = 0
+        if version in (1, 2):
+            construction_method, position = read_uint(iloc, position, 2)
+        # Data reference index
+        position += 2
+        base_offset, position = read_uint(iloc, position, base_offset_size)
+        extent_count, position = read_uint(iloc, position, 2)
+        extents = []
+        for _ in range(extent_count):
+            position += index_size
+            extent_offset, position = read_uint(iloc, position, offset_size)
+            extent_length, position = read_uint(iloc, position, length_size)
+            extents.append((base_offset + extent_offset, extent_length))
+        if item_id == exif_item_id:
+            # Only items stored in file itself are supported
+            return extents[0] if construction_method & 0xF == 0 and extents else None
+    return None
+
+
+def read_isobmff_metadata(file) -> tuple[bytes | None, dict]:
+    """
+    Walks ISOBMFF boxes (mp4, mov, heic) up to the movie header and the Exif item, seeking over media data.
+    @return TIFF block of Exif item or None, and creation date of movie as 'EXIF DateTimeOriginal' tag.
+    """
+    file_size = os.fstat(file.fileno()).st_size
+    tiff = None
+    tags = {}
+    for box_type, start, end in iterate_boxes(file, 0, file_size):
+        if box_type == b'moov':
+            for child_type, child_start, child_end in iterate_boxes(file, start, end):
+                if child_type == b'mvhd':
+                    mvhd = read_box(file, child_start, min(child_end, child_start + 20))
+                    creation_time, _ = read_uint(mvhd, 4, 8 if mvhd[0] == 1 else 4)
+                    # Zero when unknown
+                    if creation_time > 0:
+                        date_time = utc_to_exif_datetime(ISOBMFF_EPOCH + timedelta(seconds=creation_time))
+                        if date_time is not None:
+                            tags['EXIF DateTimeOriginal'] = date_time
+                    break
+        elif box_type == b'meta':
+            # Full box : version and flags precede children
+            children = {child_type:(child_start, child_end) for child_type, child_start, child_end in iterate_boxes(file, start + 4, end)}
+            if b'iinf' in children and b'iloc' in children:
+                extent = find_heif_exif_extent(read_box(file, *children[b'iinf']), read_box(file, *children[b'iloc']))
+                if extent is not None:
+                    offset, length = extent
+                    item = read_box(file, offset, offset + length)
+                    # Item starts with offset of TIFF header
+                    tiff_offset, _ = read_uint(item, 0, 4)
+                    tiff = item[4 + tiff_offset:]
+    return tiff, tags
+
+
+def read_exif_tags(photo_pathname:str, use_gps:bool=True, monitor:Monitor | None = None) -> dict:
+    """
+    Reads only the EXIF tags used to rename photos, see parse_tiff_tags, from JPEG, PNG and ISOBMFF (heic, mp4, mov) files.
+    Falls back on exifread for files that cannot be parsed this way.
+    """
+    try:
+        with open(photo_pathname, 'rb') as file:
+            signature = file.read(12)
+            file.seek(0)
+            tags = {}
+            if signature[0:2] == b'\xff\xd8':
+                tiff = read_jpeg_exif_block(file)
+            elif signature[0:8] == PNG_SIGNATURE:
+                tiff, tags = read_png_metadata(file)
+            elif signature[4:8] in ISOBMFF_FIRST_BOXES:
+                tiff, tags = read_isobmff_metadata(file)
+            else:
+                raise ValueError('Unknown file format')
+        if monitor is not None and tiff is not None:
+            monitor.count('exif_bytes_read', len(tiff))
+        # EXIF tags have precedence over other metadata
+        if tiff is not None:
+            tags.update(parse_tiff_tags(tiff, use_gps))
+        return tags
+    except (ValueError, KeyError, struct.error):
+        pass
+    with open(photo_pathname, 'rb') as file:
+        import exifread
+        exif_data = exifread.process_file(file, details=False)
+        if monitor is not None:
+            monitor.count('exif_bytes_read', file.tell())
+    result = {}
+    for name in list(EXIF_IFD0_TAGS.values()) + list(EXIF_SUBIFD_TAGS.values()) + list(EXIF_GPS_TAGS.values()):
+        if name in exif_data:
+            values = exif_data[name].values
+            result[name] = values if isinstance(values, str) else tuple(float(value.real) if hasattr(value, 'real') else float(value) for value in values)
+    return result
+
+
+def degrees_to_decimal(dms:tuple, ref:str) -> float:
+    decimal = float(dms[0] + (dms[1] / 60) + (dms[2] / 3600))
+    return -decimal if ref in ('S', 'W') else decimal
+
+
+def parse_exif_datetime(text:str | None) -> datetime | None:
+    """
+    Parses EXIF dates such as '2023:11:02 14:54:57', with fixed positions instead of strptime.
+    @return None if absent or invalid, such as the '0000:00:00 00:00:00' of some cameras.
+    """
+    if text is None or len(text) < 19 or text[4] not in ':-' or text[7] not in ':-' or text[13] != ':' or text[16] != ':':
+        return None
+    try:
+        return datetime(int(text[0:4]), int(text[5:7]), int(text[8:10]), int(text[11:13]), int(text[14:16]), int(text[17:19]))
+    except ValueError:
+        return None
+
+
+def compile_filename_date_patterns(patterns:list[str]) -> re.Pattern:
+    """
+    @return a single regex matching any of given patterns, fields of the i-th pattern being named Yi, Mi, Di, hi, mi and si.
+    """
+    alternatives = []
+    for i, pattern in enumerate(patterns):
+        for field, digits in (('Y', 4), ('M', 2), ('D', 2), ('h', 2), ('m', 2), ('s', 2)):
+            pattern = pattern.replace('{' + field + '}', f'(?P<{field}{i}>\\d{{{digits}}})')
+        alternatives.append('(?:' + pattern + ')')
+    return re.compile('|'.join(alternatives))
+
+
+FILENAME_DATE_REGEX = compile_filename_date_patterns(FILENAME_DATE_PATTERNS)
+
+
+def extract_datetime_from_filename(filename:str) -> datetime | None:
+    """
+    @return date found in given file name according to FILENAME_DATE_PATTERNS, None if none matches.
+    """
+    match = FILENAME_DATE_REGEX.search(filename)
+    if match is None:
+        return None
+    # Seconds are the last field of every pattern
+    i = match.lastgroup[1:]
+    try:
+        return datetime(int(match.group('Y' + i)), int(match.group('M' + i)), int(match.group('D' + i)), int(match.group('h' + i)), int(match.group('m' + i)), int(match.group('s' + i)))
+    except ValueError:
+        return None
+
+
+def resolve_date_time(photo_info:PhotoInfo, date_sources:list[str] = DATE_SOURCES, mtime:float | None = None):
+    """
+    Sets the date of given photo from the first of date_sources giving one, None if none does.
+    @param date_sources among ALL_DATE_SOURCES.
+    @param mtime modification time of the file, used by the 'mtime' source.
+    """
+    photo_info.date_time = None
+    photo_info.datetime_from_exif = True
+    for date_source in date_sources:
+        if date_source == 'filename':
+            date_time = extract_datetime_from_filename(os.path.basename(photo_info.pathname))
+        elif date_source == 'mtime':
+            date_time = datetime.fromtimestamp(mtime) if mtime is not None else None
+        else:
+            date_time = photo_info.exif_date_times[EXIF_DATE_SOURCES[date_source]]
+        if date_time is not None:
+            photo_info.date_time = date_time
+            photo_info.datetime_from_exif = date_source != 'mtime'
+            return
+
+
+def read_photo_metadata(photo_pathname:str, use_gps:bool=False, monitor:Monitor | None = None, date_sources:list[str] = DATE_SOURCES) -> PhotoInfo:
+    """
+    @return metadata of given photo, with date_time None if it cannot be found, see resolve_date_time.
+    """
+    exif_data = read_exif_tags(photo_pathname, use_gps, monitor)
+
+    # Recover gps info if present
+    latitude_decimal = None
+    longitude_decimal = None
+    if use_gps and 'GPS GPSLatitude' in exif_data.keys() and 'GPS GPSLongitude' in exif_data.keys():
+        # Convert latitude & longitude to decimal instead of degrees-minutes-secondes
+        longitude_decimal = degrees_to_decimal(exif_data['GPS GPSLongitude'], exif_data.get('GPS GPSLongitudeRef', ''))
+        latitude_decimal = degrees_to_decimal(exif_data['GPS GPSLatitude'], exif_data.get('GPS GPSLatitudeRef', ''))
+
+    photo_info = PhotoInfo(photo_pathname, None, True, latitude_decimal, longitude_decimal)
+    photo_info.exif_date_times = tuple(parse_exif_datetime(exif_data.get(tag)) for tag in EXIF_DATE_TAGS)
+    resolve_date_time(photo_info, date_sources)
+    photo_info.gps_read = use_gps
+    # Digits of fraction of second, such as '042'
+    subsec = exif_data.get('EXIF SubSecTimeOriginal', '')
+    if subsec.isdigit():
+        photo_info.subsec = float('0.' + subsec)
+    return photo_info
+
+
+def read_photo_info(photo_pathname:str, use_gps:bool=False, datetime_fallback_os:bool=False, index:MetadataIndex | None = None, monitor:Monitor | None = None,
+                    date_sources:list[str] | None = None) -> PhotoInfo | None:
+    """
+    @param datetime_fallback_os whether date of last modification is used when date_sources give none.
+    @param index of metadata, used instead of reading unchanged photos and updated otherwise.
+    @param date_sources see resolve_date_time, defaults to DATE_SOURCES.
+    @return metadata of given photo, None if it cannot be renamed.
+    """
+    if monitor is None:
+        monitor = Monitor()
+    date_sources = date_sources if date_sources is not None else DATE_SOURCES
+    if datetime_fallback_os and 'mtime' not in date_sources:
+        date_sources = date_sources + ['mtime']
+    try:
+        stat = os.stat(photo_pathname)
+        photo_info = index.get(photo_pathname, stat) if index is not None else None
+        if photo_info is None or (use_gps and not photo_info.gps_read):
+            with monitor.timer('exif'):
+                photo_info = read_photo_metadata(photo_pathname, use_gps, monitor, date_sources)
+            if index is not None:
+                monitor.count('index_misses')
+                index.put(photo_info, stat)
+        else:
+            monitor.count('index_hits')
+        photo_info.size = stat.st_size
+        photo_info.mtime_ns = stat.st_mtime_ns
+
+        # Index keeps dates of metadata only, such that date sources can change between runs
+        resolve_date_time(photo_info, date_sources, stat.st_mtime)
+        if photo_info.date_time is None or not photo_info.datetime_from_exif:
+            monitor.log("Missing datetime EXIF for " + photo_pathname)
+        if photo_info.date_time is None:
+            return None
+        return photo_info
+    except Exception as e:
+        monitor.error(e, photo_pathname)
+        return None
+
+
+def datetime_to_seconds(date_time:datetime) -> int:
+    """
+    @return seconds since year 1 of given naive date, compact and free of time zone conversions.
+    """
+    return date_time.toordinal() * 86400 + date_time.hour * 3600 + date_time.minute * 60 + date_time.second
+
+
+def seconds_to_datetime(seconds:int) -> datetime:
+    return datetime.fromordinal(seconds // 86400) + timedelta(seconds=seconds % 86400)
+
+
+def compute_new_name(date_time_obj:datetime, datetime_from_exif:bool, extension:str, country:str='', town:str='', suffix:str='', sort_by_dir:SortByDir=SortByDir.SORT_BY_NONE) -> str:
+    """
+    @param extension of the original name, such as '.JPEG'.
+    @return the new name of a photo, in its subdirectory if sort_by_dir requires one.
+    """
+    # Create new name
+    new_name = f'{date_time_obj.year:04}-{date_time_obj.month:02}-{date_time_obj.day:02}'
+    new_name += '-'
+    new_name += f'{date_time_obj.hour:02}H{date_time_obj.minute:02}'#m{date_time_obj.second:02}s'
+    if not datetime_from_exif:
+        new_name += '~'
+    if country != '':
+        new_name += f'-{country}'
+    if town != '':
+        new_name += f'-{town}'
+    if suffix != '':
+        new_name += f'-{suffix}'
+    extension = extension.lower()
+    new_name += RENAMED_EXTENSIONS.get(extension, extension)
+    # Prepend subdirectory if necessary
+    if sort_by_dir == SortByDir.SORT_BY_YEAR:
+        return os.path.join(f'{date_time_obj.year:04}', new_name)
+    elif sort_by_dir == SortByDir.SORT_BY_MONTH:
+        return os.path.join(f'{date_time_obj.year:04}-{date_time_obj.month:02}', new_name)
+    elif sort_by_dir == SortByDir.SORT_BY_YEAR_AND_MONTH:
+        return os.path.join(f'{date_time_obj.year:04}', f'{date_time_obj.month:02}', new_name)
+    return new_name
+
+
+def compute_new_pathname(photo_info:PhotoInfo, country:str='', town:str='', suffix:str='', sort_by_dir:SortByDir=SortByDir.SORT_BY_NONE, destination_dir:str | None = None) -> str:
+    """
+    @param destination_dir where the photo is sorted, defaults to its directory.
+    @return the new absolute pathname of given photo.
+    """
+    if destination_dir is None:
+        destination_dir = os.path.dirname(photo_info.pathname)
+    new_name = compute_new_name(photo_info.date_time, photo_info.datetime_from_exif, os.path.splitext(photo_info.pathname)[1], country, town, suffix, sort_by_dir)
+    return os.path.join(destination_dir, new_name)
+
+
+def existing_name_numbers(directory:str, ignored_names=()) -> dict:
+    """
+    @param ignored_names names of files not to take into account, such as the ones of photos being renamed.
+    @return dict of each name used in directory to the highest number of the files using it, 0 if only used as is.
+    A numbered file uses both its own name and its name without number : suffixes ending with digits,
+    such as name-2024.jpg, are used as is and not only as number 2024 of name.jpg.
+    """
+    numbers = {}
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        # Not created yet
+        return numbers
+    for name in names:
+        if name in ignored_names:
+            continue
+        numbers.setdefault(name, 0)
+        match = NUMBERED_NAME_PATTERN.fullmatch(name)
+        if match.group(2) is not None:
+            unnumbered_name = match.group(1) + (match.group(3) or '')
+            numbers[unnumbered_name] = max(numbers.get(unnumbered_name, 0), int(match.group(2)))
+    return numbers
+
+
+def number_duplicate_names(new_pathnames:list[str], creation_key, existing_number=None) -> int:
+    """
+    Appends -1, -2... to the pathnames shared by several photos, in the order of their creation keys.
+    Photos with equal keys keep their relative order.
+    @param creation_key function of the index of a photo giving its creation key.
+    @param existing_number if given, function of a pathname giving the highest number of the files already using it,
+    see existing_name_numbers, or None. Photos using it are then numbered after these files, even if alone.
+    @return number of photos whose name was numbered.
+    """
+    collisions = 0
+    indices_by_pathname = {}
+    for i, new_pathname in enumerate(new_pathnames):
+        indices_by_pathname.setdefault(new_pathname, []).append(i)
+    for new_pathname, indices in indices_by_pathname.items():
+        highest_number = existing_number(new_pathname) if existing_number is not None else None
+        # Each path should be unical
+        if len(indices) == 1 and highest_number is None:
+            continue
+        indices.sort(key=creation_key)
+        new_pathname_without_ext, ext = os.path.splitext(new_pathname)
+        for order_integer_suffix, i in enumerate(indices, 1 if highest_number is None else highest_number + 1):
+            new_pathnames[i] = new_pathname_without_ext + f'-{order_integer_suffix}' + ext
+        collisions += len(indices)
+    return collisions
+
+
+def is_sorted_directory_name(name:str) -> bool:
+    """
+    @return True for subdirectories created by sorting : YYYY, YYYY-MM (and MM within YYYY).
+    """
+    return SORTED_DIRECTORY_PATTERN.fullmatch(name) is not None
+
+
+def matches_patterns(name:str, patterns:list[str]) -> bool:
+    """
+    @return whether name matches one of given lower case patterns, case-insensitive.
+    """
+    name = name.lower()
+    return any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)
+
+
+class ScanFilter:
+    """
+    Which files and subdirectories of a directory are scanned, see scan_photos.
+    """
+    def __init__(self, directory:str, include:list[str] | None = None, exclude:list[str] | None = None) -> None:
+        self.include = [pattern.lower() for pattern in (include if include else PHOTO_PATTERNS)]
+        self.exclude = [pattern.lower() for pattern in (exclude if exclude else [])]
+        self.duplicates_dir = os.path.join(os.path.abspath(directory), DUPLICATES_SUBDIR)
+
+    def is_photo(self, name:str) -> bool:
+        return not name.startswith('.') and not matches_patterns(name, self.exclude) and matches_patterns(name, self.include)
+
+    def is_subdirectory(self, name:str, pathname:str) -> bool:
+        return not name.startswith('.') and not matches_patterns(name, self.exclude) and not is_sorted_directory_name(name) and pathname != self.duplicates_dir
+
+
+def scan_photos(directory:str, recursive:bool=False, include:list[str] | None = None, exclude:list[str] | None = None):
+    """
+    Yields absolute pathnames of photos as they are found, directory by directory.
+    Hidden files, PHOTOSORTER_SUBDIR, DUPLICATES_SUBDIR and already sorted subdirectories are skipped.
+    @param recursive whether subdirectories are scanned.
+    @param include case-insensitive patterns of file names to process, defaults to PHOTO_PATTERNS.
+    @param exclude case-insensitive patterns of file and directory names to skip.
+    """
+    scan_filter = ScanFilter(directory, include, exclude)
+    pending_directories = [os.path.abspath(directory)]
+    while len(pending_directories) != 0:
+        subdirectories = []
+        try:
+            with os.scandir(pending_directories.pop()) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_file():
+                            if scan_filter.is_photo(entry.name):
+                                yield entry.path
+                        elif recursive and entry.is_dir(follow_symlinks=False) and scan_filter.is_subdirectory(entry.name, entry.path):
+                            subdirectories.append(entry.path)
+                    except OSError as e:
+                        print(e, file=sys.stderr)
+        except OSError as e:
+            print(e, file=sys.stderr)
+        # Depth first, in alphabetical order
+        pending_directories.extend(sorted(subdirectories, reverse=True))
+
+
+def imap_ordered(function, iterable, jobs:int=1):
+    """
+    Lazy equivalent of map() on a pool of jobs threads. Results are yielded in the order of iterable,
+    which is consumed at most a few items ahead of results.
+    """
+    if jobs <= 1:
+        yield from map(function, iterable)
+        return
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        for item in iterable:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= 4 * jobs:
+                yield pending.popleft().result()
+        while len(pending) != 0:
+            yield pending.popleft().result()
+
+
+def next_free_pathname(pathname:str) -> str:
+    """
+    @return given pathname if no file has it, otherwise the first free one among name-1.ext, name-2.ext...
+    """
+    if not os.path.lexists(pathname):
+        return pathname
+    pathname_without_ext, ext = os.path.splitext(pathname)
+    order_integer_suffix = 1
+    while os.path.lexists(pathname_without_ext + f'-{order_integer_suffix}' + ext):
+        order_integer_suffix += 1
+    return pathname_without_ext + f'-{order_integer_suffix}' + ext
+
+
+def hash_file(pathname:str, size:int, sample_size:int | None = None) -> bytes:
+    """
+    @param sample_size if given, only the first and last sample_size bytes of larger files are hashed.
+    @return digest of the content of given file.
+    """
+    import hashlib
+    digest = hashlib.blake2b(digest_size=20)
+    with open(pathname, 'rb', buffering=0) as file:
+        if sample_size is not None and size > 2 * sample_size:
+            digest.update(file.read(sample_size))
+            file.seek(-sample_size, os.SEEK_END)
+            digest.update(file.read(sample_size))
+        else:
+            # Large sequential reads in a single buffer
+            buffer = bytearray(HASH_CHUNK_SIZE)
+            view = memoryview(buffer)
+            while (count := file.readinto(buffer)) > 0:
+                digest.update(view[:count])
+    return digest.digest()
+
+
+def find_duplicates(pathnames, jobs:int=1, monitor:Monitor | None = None) -> list[list[str]]:
+    """
+    Finds files of identical content while reading as little as possible : files are grouped by size,
+    then by a hash of their first and last DEDUPE_SAMPLE_SIZE bytes, and only files still sharing a group are fully hashed.
+    @param jobs number of files hashed in parallel.
+    @return groups of identical files, each ordered from the original (oldest, then shortest name) to its copies.
+    """
+    if monitor is None:
+        monitor = Monitor()
+    stats = {}
+    groups = {}
+    with monitor.timer('dedupe_size'):
+        for pathname in pathnames:
+            try:
+                stat = os.stat(pathname)
+            except OSError as e:
+                monitor.error(e, pathname)
+                continue
+            if stat.st_size != 0:
+                stats[pathname] = stat
+                groups.setdefault(stat.st_size, []).append(pathname)
+
+    def regroup(groups, stage:str, sample_size:int | None) -> dict:
+        def key(pathname):
+            size = stats[pathname].st_size
+            try:
+                with monitor.timer(stage):
+                    digest = hash_file(pathname, size, sample_size)
+                monitor.count('dedupe_bytes_hashed', min(size, 2 * sample_size) if sample_size is not None else size)
+                return size, digest
+            except OSError as e:
+                monitor.error(e, pathname)
+                # Never equal to another key
+                return pathname
+        candidates = [pathname for group in groups if len(group) > 1 for pathname in group]
+        result = {}
+        for pathname, pathname_key in zip(candidates, imap_ordered(key, candidates, jobs)):
+            result.setdefault(pathname_key, []).append(pathname)
+        return result
+
+    groups = {key:group for key, group in regroup(groups.values(), 'dedupe_sample', DEDUPE_SAMPLE_SIZE).items() if isinstance(key, tuple)}
+    # Files not larger than both samples are already fully hashed
+    confirmed = [group for (size, _), group in groups.items() if size <= 2 * DEDUPE_SAMPLE_SIZE]
+    confirmed += regroup([group for (size, _), group in groups.items() if size > 2 * DEDUPE_SAMPLE_SIZE], 'dedupe_full', None).values()
+    return [sorted(group, key=lambda pathname: (stats[pathname].st_mtime_ns, len(os.path.basename(pathname)), pathname)) for group in confirmed if len(group) > 1]
+
+
+def plan_directory(directory:str, use_gps:bool=False, suffix:str='', sort_by_dir:SortByDir=SortByDir.SORT_BY_NONE, datetime_fallback_os:bool=False, jobs:int=1, geocoder:Geocoder | None = None, geocoding_rate:float | None = None,
+                   index:MetadataIndex | None = None, recursive:bool=False, include:list[str] | None = None, exclude:list[str] | None = None, monitor:Monitor | None = None,
+                   cancel:Event | None = None, photo_pathnames:list[str] | None = None, date_sources:list[str] | None = None, output:str | None = None,
+                   number_after_existing:bool=False):
+    """
+    Computes how to sort photos of given directory, without modifying any file.
+    Yields, for each directory containing photos, an iterable of renames (old pathname, new pathname, size, mtime_ns),
+    to be consumed before the next one.
+    See PhotoSorter for parameters.
+    @param cancel once set, no more photos are read nor planned.
+    @param photo_pathnames photos to sort instead of the ones found in directory, grouped by directory.
+    @param number_after_existing whether new names already used by other files are numbered after them,
+    such as when sorting into an output directory or sorting arrivals of a watched directory.
+    """
+    destination_dir = os.path.abspath(directory)
+    output_dir = os.path.abspath(output) if output is not None else None
+    if monitor is None:
+        monitor = Monitor()
+    if not use_gps:
+        geocoder = None
+    elif geocoder is None:
+        geocoder = default_geocoder()
+    # Locations are resolved in background while metadata of next photos are read,
+    # each distinct location being queried once.
+    scheduler = GeocodingScheduler(geocoder, geocoding_rate, monitor=monitor, cancel=cancel) if geocoder is not None else None
+    # Read metadata of each photo as soon as it is found, in a pool of workers if required.
+    # Results are collected in the order of discovery whatever the order of completion,
+    # such that duplicates numbering and report are identical to a serial run.
+    def read(photo_pathname):
+        if cancel is not None and cancel.is_set():
+            return photo_pathname, None
+        monitor.count('files_scanned')
+        photo_info = read_photo_info(photo_pathname, use_gps, datetime_fallback_os, index, monitor, date_sources)
+        if photo_info is None:
+            return photo_pathname, None
+        # Future of location, or location already known
+        location = None
+        if scheduler is not None and photo_info.latitude is not None and photo_info.country is None:
+            location = scheduler.submit(photo_info.latitude, photo_info.longitude)
+        elif use_gps and photo_info.country is not None:
+            location = (photo_info.country, photo_info.town)
+        # Compact record kept until its whole directory is planned : name, date, whether date is from metadata, fraction of second, size, modification time, location
+        return photo_pathname, (os.path.basename(photo_pathname), datetime_to_seconds(photo_info.date_time), photo_info.datetime_from_exif, photo_info.subsec,
+                                photo_info.size, photo_info.mtime_ns, location)
+    if photo_pathnames is None:
+        photo_pathnames = scan_photos(destination_dir, recursive, include, exclude)
+    photo_infos = imap_ordered(read, photo_pathnames, jobs)
+
+    def renames(photos_dir:str, sorted_dir:str, records:list[tuple], new_names:list[str]):
+        # Full paths are only built when renaming
+        for record, new_name in zip(records, new_names):
+            yield os.path.join(photos_dir, record[0]), os.path.join(sorted_dir, new_name), record[4], record[5]
+
+    try:
+        # New names are in the directory of each photo, or its mirror in output directory,
+        # hence photos of different directories never share a name : each directory is planned as soon as all its photos are read.
+        for photos_dir, results in groupby(photo_infos, key=lambda result: os.path.dirname(result[0])):
+            if cancel is not None and cancel.is_set():
+                return
+            sorted_dir = os.path.normpath(os.path.join(output_dir, os.path.relpath(photos_dir, destination_dir))) if output_dir is not None else photos_dir
+            # All photos of the directory are read, submitting their locations, before waiting for any location :
+            # geocoding overlaps reading even without jobs.
+            read_records = []
+            for photo_pathname, record in results:
+                if record is None:
+                    monitor.emit('skipped', pathname=photo_pathname)
+                else:
+                    read_records.append(record)
+            records = []
+            # Relative to sorted_dir
+            new_names = []
+            for record in read_records:
+                if cancel is not None and cancel.is_set():
+                    return
+                name, seconds, datetime_from_exif, _, _, _, location = record
+                country, town = '', ''
+                if isinstance(location, tuple):
+                    country, town = location
+                elif location is not None:
+                    try:
+                        with monitor.timer('geocode_wait'):
+                            country, town = location.result()
+                    except Exception as e:
+                        if cancel is not None and cancel.is_set():
+                            return
+                        monitor.error(e, os.path.join(photos_dir, name))
+                        monitor.emit('skipped', pathname=os.path.join(photos_dir, name))
+                        continue
+                    if index is not None:
+                        index.set_location(os.path.join(photos_dir, name), country, town)
+                records.append(record)
+                new_names.append(compute_new_name(seconds_to_datetime(seconds), datetime_from_exif, os.path.splitext(name)[1], country, town, suffix, sort_by_dir))
+            del read_records
+
+            existing_number = None
+            if number_after_existing:
+                # Names of renamed photos are not taken by other files
+                renamed_names = {record[0] for record in records}
+                numbers_by_directory = {}
+                def existing_number(new_name:str) -> int | None:
+                    target_dir, name = os.path.split(os.path.join(sorted_dir, new_name))
+                    if target_dir not in numbers_by_directory:
+                        numbers_by_directory[target_dir] = existing_name_numbers(target_dir, renamed_names if target_dir == photos_dir else ())
+                    return numbers_by_directory[target_dir].get(name)
+
+            # Handle name duplicates, ordered by exact moment of creation, then name as last resort such that order does not depend on order of discovery
+            with monitor.timer('dedupe'):
+                monitor.count('collisions', number_duplicate_names(new_names, lambda i: (records[i][1] % 60, records[i][3], records[i][5], records[i][0]), existing_number))
+
+            yield renames(photos_dir, sorted_dir, records, new_names)
+    finally:
+        photo_infos.close()
+        if scheduler is not None:
+            scheduler.close()
+            geocoder.save()
+
+
+# Errors of kernel copies unsupported between given files, see copy_file_data
+UNSUPPORTED_COPY_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.ENOTSOCK}
+# Bounds the number of concurrent copies of move_file
+transfer_slots = BoundedSemaphore(MAX_TRANSFERS)
+
+
+def copy_file_data(source_fd:int, destination_fd:int, size:int):
+    """
+    Copies size bytes between given files, in kernel with copy_file_range or sendfile where supported,
+    by reads and writes otherwise. File descriptors are expected at offset 0.
+    """
+    copied = 0
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while copied < size:
+                count = os.copy_file_range(source_fd, destination_fd, min(size - copied, TRANSFER_CHUNK_SIZE))
+                if count == 0:
+                    break
+                copied += count
+        except OSError as e:
+            if e.errno not in UNSUPPORTED_COPY_ERRNOS:
+                raise
+    if copied < size and hasattr(os, 'sendfile'):
+        try:
+            while copied < size:
+                # Offset of source is given, hence left unchanged
+                count = os.sendfile(destination_fd, source_fd, copied, min(size - copied, TRANSFER_CHUNK_SIZE))
+                if count == 0:
+                    break
+                copied += count
+        except OSError as e:
+            if e.errno not in UNSUPPORTED_COPY_ERRNOS:
+                raise
+    if copied < size:
+        os.lseek(source_fd, copied, os.SEEK_SET)
+        while copied < size:
+            data = os.read(source_fd, min(size - copied, TRANSFER_CHUNK_SIZE))
+            if len(data) == 0:
+                break
+            view = memoryview(data)
+            while len(view) > 0:
+                view = view[os.write(destination_fd, view):]
+            copied += len(data)
+    if copied != size:
+        raise OSError(errno.EIO, 'File size changed while copied')
+
+
+def sync_directory(directory:str):
+    """
+    Syncs entries of given directory to disk, where supported.
+    """
+    if os.name != 'posix':
+        return
+    directory_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(directory_fd)
+    finally:
+        os.close(directory_fd)
+
+
+# Errors of links unsupported by a file system, see rename_no_replace
+UNSUPPORTED_LINK_ERRNOS = {errno.EPERM, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EMLINK}
+
+
+def rename_no_replace(old_pathname:str, new_pathname:str):
+    """
+    Renames a file like os.rename, but raises FileExistsError instead of replacing a file at new_pathname,
+    even if it is created concurrently.
+    """
+    try:
+        # Fails if new_pathname exists, unlike rename
+        os.link(old_pathname, new_pathname)
+    except FileExistsError:
+        # Change of case only on a case insensitive file system
+        if os.path.samefile(old_pathname, new_pathname):
+            os.rename(old_pathname, new_pathname)
+            return
+        raise
+    except OSError as e:
+        if e.errno not in UNSUPPORTED_LINK_ERRNOS:
+            raise
+        # No links on this file system : reserve new_pathname, then replace the reserved empty file only
+        os.close(os.open(new_pathname, os.O_WRONLY | os.O_CREAT | os.O_EXCL))
+        try:
+            os.replace(old_pathname, new_pathname)
+        except BaseException:
+            os.remove(new_pathname)
+            raise
+        return
+    os.remove(old_pathname)
+
+
+def copy_file(old_pathname:str, new_pathname:str, verify:bool=False):
+    """
+    Copies a file with its permissions and timestamps, such that new_pathname only appears once its whole content is on disk.
+    Raises FileExistsError if new_pathname exists, even if created concurrently.
+    @param verify whether the copy is read back from disk and compared to the source by checksum.
+    """
+    import tempfile
+    stat = os.stat(old_pathname)
+    new_dir, new_filename = os.path.split(os.path.abspath(new_pathname))
+    # Unique such that concurrent copies to the same name do not write the same file
+    temporary_fd, temporary_pathname = tempfile.mkstemp(suffix='.photosorter-tmp', prefix='.' + new_filename + '.', dir=new_dir)
+    try:
+        with open(old_pathname, 'rb', buffering=0) as source, open(temporary_fd, 'wb', buffering=0) as destination:
+            copy_file_data(source.fileno(), destination.fileno(), stat.st_size)
+            os.chmod(destination.fileno() if os.chmod in os.supports_fd else temporary_pathname, stat.st_mode & 0o7777)
+            os.utime(destination.fileno() if os.utime in os.supports_fd else temporary_pathname, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            os.fsync(destination.fileno())
+            if verify and hasattr(os, 'posix_fadvise'):
+                # Read back from disk rather than from cache
+                os.posix_fadvise(destination.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        if verify and hash_file(old_pathname, stat.st_size) != hash_file(temporary_pathname, stat.st_size):
+            raise OSError(errno.EIO, 'Copy differs from source', old_pathname)
+        rename_no_replace(temporary_pathname, new_pathname)
+    except BaseException:
+        try:
+            os.remove(temporary_pathname)
+        except OSError:
+            pass
+        raise
+    sync_directory(new_dir)
+
+
+def move_file(old_pathname:str, new_pathname:str, verify:bool=False, record=None, monitor:Monitor | None = None) -> bool:
+    """
+    Moves a file with a rename, or between file systems with a durable copy followed by the removal of the source.
+    Raises FileExistsError if new_pathname exists, even if created concurrently.
+    @param verify see copy_file.
+    @param record called with whether the file was copied, once moved but before the source of a copy is removed.
+    @return whether the file was copied.
+    """
+    if monitor is None:
+        monitor = Monitor()
+    try:
+        rename_no_replace(old_pathname, new_pathname)
+        copied = False
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        with transfer_slots, monitor.timer('transfer'):
+            copy_file(old_pathname, new_pathname, verify)
+        monitor.count('transfers')
+        monitor.count('transfer_bytes', os.path.getsize(new_pathname))
+        copied = True
+    if record is not None:
+        record(copied)
+    if copied:
+        os.remove(old_pathname)
+    return copied
+
+
+def apply_rename(old_pathname:str, new_pathname:str, size:int, mtime_ns:int, journal:RenameJournal, index:MetadataIndex | None = None, verify:bool=False, monitor:Monitor | None = None,
+                 verify_copy:bool=False) -> bool:
+    """
+    Renames a file as planned by plan_directory, moving it to another file system if needed, and records it in journal.
+    @param verify whether the file is checked to be unchanged since planned, by size and modification time.
+    @param verify_copy see copy_file.
+    @return whether the file was renamed.
+    """
+    if monitor is None:
+        monitor = Monitor()
+    try:
+        if old_pathname == new_pathname:
+            return False
+        if verify:
+            stat = os.stat(old_pathname)
+            if stat.st_size != size or stat.st_mtime_ns != mtime_ns:
+                monitor.error("Error : file changed since planned : " + old_pathname, old_pathname)
+                return False
+        if os.path.isfile(new_pathname):
+            monitor.error("Error : new name already exists : " + old_pathname + ' -> ' + new_pathname, old_pathname)
+            return False
+        def record(copied:bool):
+            if index is not None:
+                index.rename(old_pathname, new_pathname)
+            # Source of a copy is only removed once its move is on disk
+            journal.record(old_pathname, new_pathname, sync=copied)
+        with monitor.timer('rename'):
+            os.makedirs(os.path.dirname(new_pathname), exist_ok=True)
+            try:
+                move_file(old_pathname, new_pathname, verify_copy, record, monitor)
+            except FileExistsError:
+                # Created since checked, such as by another process sorting into the same output
+                monitor.error("Error : new name already exists : " + old_pathname + ' -> ' + new_pathname, old_pathname)
+                return False
+        monitor.count('renames')
+        monitor.log('Renamed : ' +  old_pathname + ' -> ' + new_pathname)
+        monitor.emit('renamed', old=old_pathname, new=new_pathname)
+        return True
+    except Exception as e:
+        monitor.error(e, old_pathname)
+        return False
+
+
+def apply_renames(renames:list[tuple], journal:RenameJournal, index:MetadataIndex | None = None, verify:bool=False, monitor:Monitor | None = None):
+    """
+    Renames files as planned by plan_directory, see apply_rename.
+    """
+    for old_pathname, new_pathname, size, mtime_ns in renames:
+        apply_rename(old_pathname, new_pathname, size, mtime_ns, journal, index, verify, monitor)
+
+
+def open_metadata_index(directory:str, read_only:bool=False) -> MetadataIndex | None:
+    """
+    @param read_only see MetadataIndex, None being returned if there is no index yet.
+    """
+    index_pathname = os.path.join(os.path.abspath(directory), PHOTOSORTER_SUBDIR, METADATA_INDEX_FILENAME)
+    if read_only and not os.path.isfile(index_pathname):
+        return None
+    return MetadataIndex(index_pathname, read_only)
+
+
+def process_directory(directory:str, use_gps:bool=False, suffix:str='', sort_by_dir:SortByDir=SortByDir.SORT_BY_NONE, datetime_fallback_os:bool=False, jobs:int=1, geocoder:Geocoder | None = None, geocoding_rate:float | None = None, use_index:bool=True,
+                      recursive:bool=False, include:list[str] | None = None, exclude:list[str] | None = None, monitor:Monitor | None = None, dedupe:str | None = None,
+                      date_sources:list[str] | None = None, output:str | None = None, verify_copies:bool=False):
+    """
+    Sorts photos of given directory, see PhotoSorter for parameters.
+    """
+    sorter = PhotoSorter(use_gps, suffix, sort_by_dir, datetime_fallback_os, jobs, geocoder, geocoding_rate, use_index, recursive, include, exclude, monitor, dedupe, date_sources,
+                         output, verify_copies)
+    for _ in sorter.process(directory):
+        pass
+
+
+def write_plan(plan_pathname:str, directory:str, *args, **kwargs) -> int:
+    """
+    Writes how photos of given directory would be sorted, without modifying them. Arguments are the ones of PhotoSorter.
+    The plan has one JSON record per line : a header, then a record per photo to rename, with its size and modification time.
+    @return number of photos to rename.
+    """
+    return PhotoSorter(*args, **kwargs).write_plan(plan_pathname, directory)
+
+
+def apply_plan(plan_pathname:str, directory:str | None = None, monitor:Monitor | None = None):
+    """
+    Renames files as planned by write_plan, skipping files modified since planned. Photos are not read again.
+    @param directory where the plan applies, defaults to the directory it was computed for.
+    """
+    with open(plan_pathname, encoding='utf-8') as plan_file:
+        header = json.loads(plan_file.readline())
+        if header.get('type') != 'plan':
+            raise ValueError('Not a plan : ' + plan_pathname)
+        directory = os.path.abspath(directory if directory is not None else header['directory'])
+        index_pathname = os.path.join(directory, PHOTOSORTER_SUBDIR, METADATA_INDEX_FILENAME)
+        index = MetadataIndex(index_pathname) if os.path.isfile(index_pathname) else None
+        journal = RenameJournal(directory)
+        try:
+            for line in plan_file:
+                record = json.loads(line)
+                if record.get('type') == 'rename':
+                    apply_renames([(os.path.join(directory, record['old']), os.path.join(directory, record['new']), record['size'], record['mtime_ns'])], journal, index, verify=True, monitor=monitor)
+        finally:
+            journal.close()
+            if index is not None:
+                index.close()
+
+
+def report_filenames(photosorter_dir:str) -> list[str]:
+    """
+    @return names of the reports of renamed files, other files of photosorter_dir being ignored.
+    """
+    return [filename for filename in os.listdir(photosorter_dir) if REPORT_FILENAME_PATTERN.fullmatch(filename)]
+
+
+def build_revert_plan(directory:str, report_pathnames:list[str]) -> dict:
+    """
+    Merges reports, given from oldest to newest, into a single plan where chained renames are collapsed :
+    A -> B then B -> C gives C -> A.
+    @return dict of current pathname to original pathname of each file to restore.
+    """
+    plan = {}
+    for report_pathname in report_pathnames:
+        for old_pathname, new_pathname in read_report(report_pathname, directory):
+            plan[new_pathname] = plan.pop(old_pathname, old_pathname)
+    # Files renamed back to their original name
+    return {current_pathname:original_pathname for current_pathname, original_pathname in plan.items() if current_pathname != original_pathname}
+
+
+def remove_empty_parent_directories(pathnames, directory:str):
+    """
+    Removes the empty directories containing given pathnames, and their empty parents up to directory, deepest first.
+    """
+    directory = os.path.abspath(directory)
+    candidates = set()
+    for pathname in pathnames:
+        parent = os.path.dirname(os.path.abspath(pathname))
+        while parent not in candidates and len(parent) > len(directory) and parent.startswith(directory):
+            candidates.add(parent)
+            parent = os.path.dirname(parent)
+    for candidate in sorted(candidates, key=len, reverse=True):
+        try:
+            os.rmdir(candidate)
+        except OSError:
+            # Not empty
+            pass
+
+
+def remove_empty_sorted_directories(pathnames):
+    """
+    Removes the empty subdirectories created by sorting containing given pathnames, such as the ones of an output directory.
+    """
+    candidates = set()
+    for pathname in pathnames:
+        parent = os.path.dirname(os.path.abspath(pathname))
+        while parent not in candidates:
+            name = os.path.basename(parent)
+            # MM within YYYY
+            if not (is_sorted_directory_name(name) or (len(name) == 2 and name.isdigit() and is_sorted_directory_name(os.path.basename(os.path.dirname(parent))))):
+                break
+            candidates.add(parent)
+            parent = os.path.dirname(parent)
+    for candidate in sorted(candidates, key=len, reverse=True):
+        try:
+            os.rmdir(candidate)
+        except OSError:
+            # Not empty
+            pass
+
+
+def revert_directory(directory:str, jobs:int=1, monitor:Monitor | None = None, cancel:Event | None = None) -> int:
+    """
+    @param jobs number of directories restored in parallel.
+    @param monitor collecting statistics and per-file messages.
+    @param cancel once set, no more files are restored. Restored files are then recorded in a new report,
+    such that the next revert restores the remaining ones.
+    @return 0 for success, 1 if cannot find .photosorter directory, 2 if cancelled, -1 for unknown error.
+    """
+    if monitor is None:
+        monitor = Monitor()
+    start = time.perf_counter()
+    # Pathnames of the metadata index are absolute
+    directory = os.path.abspath(directory)
+    try:
+        photosorter_dir = os.path.join(directory, PHOTOSORTER_SUBDIR)
+        if not os.path.isdir(photosorter_dir):
+            return 1
+        # Numerical order, 10.json being after 2.json
+        reports_filenames = sorted(report_filenames(photosorter_dir), key=lambda filename: int(REPORT_FILENAME_PATTERN.fullmatch(filename).group(1)))
+        if len(reports_filenames) == 0:
+            return 1
+        full_reports_filenames = [os.path.join(photosorter_dir, report_filename) for report_filename in reports_filenames]
+        with monitor.timer('revert_plan'):
+            pending = build_revert_plan(directory, full_reports_filenames)
+        monitor.emit('revert_planned', count=len(pending))
+        index_pathname = os.path.join(photosorter_dir, METADATA_INDEX_FILENAME)
+        index = MetadataIndex(index_pathname) if os.path.isfile(index_pathname) else None
+        restored_pathnames = []
+        # Only kept if cancelled
+        journal = RenameJournal(directory)
+        journal_lock = Lock()
+
+        def restore(pairs:list[tuple[str, str]]):
+            for current_pathname, original_pathname in pairs:
+                if cancel is not None and cancel.is_set():
+                    return
+                try:
+                    if os.path.lexists(original_pathname):
+                        monitor.error("Error : original name already exists : " + current_pathname + ' -> ' + original_pathname, current_pathname)
+                        continue
+                    def record(copied:bool):
+                        if index is not None:
+                            index.rename(current_pathname, original_pathname)
+                        with journal_lock:
+                            journal.record(current_pathname, original_pathname, sync=copied)
+                    with monitor.timer('restore'):
+                        # Files sorted to another file system are moved back
+                        move_file(current_pathname, original_pathname, record=record, monitor=monitor)
+                    monitor.count('restored')
+                    monitor.log(current_pathname + ' -> ' + original_pathname)
+                    monitor.emit('restored', old=current_pathname, new=original_pathname)
+                    restored_pathnames.append(current_pathname)
+                except FileNotFoundError:
+                    # Moved or deleted since sorted
+                    monitor.count('missing')
+                    monitor.emit('skipped', pathname=current_pathname)
+                except Exception as e:
+                    monitor.error(e, current_pathname)
+
+        # A file cannot be restored while its original name is used by another file still to be restored,
+        # hence files are restored in waves, usually a single one.
+        while len(pending) != 0 and not (cancel is not None and cancel.is_set()):
+            ready = [(current_pathname, original_pathname) for current_pathname, original_pathname in pending.items() if original_pathname not in pending]
+            if len(ready) == 0:
+                # Cycle such as A -> B, B -> A : move one file aside
+                current_pathname, original_pathname = next(iter(pending.items()))
+                temporary_pathname = current_pathname + '.photosorter-tmp'
+                os.rename(current_pathname, temporary_pathname)
+                if index is not None:
+                    index.rename(current_pathname, temporary_pathname)
+                journal.record(current_pathname, temporary_pathname)
+                del pending[current_pathname]
+                pending[temporary_pathname] = original_pathname
+                continue
+            # Files are restored in parallel per destination directory
+            pairs_by_directory = {}
+            for current_pathname, original_pathname in ready:
+                pairs_by_directory.setdefault(os.path.dirname(original_pathname), []).append((current_pathname, original_pathname))
+                del pending[current_pathname]
+            for _ in imap_ordered(restore, pairs_by_directory.values(), jobs):
+                pass
+
+        journal.close()
+        if index is not None:
+            index.close()
+        # Remove empty directories left by revert
+        remove_empty_parent_directories(restored_pathnames, directory)
+        remove_empty_sorted_directories(restored_pathnames)
+        if cancel is not None and cancel.is_set():
+            return 2
+        if journal.pathname is not None:
+            full_reports_filenames.append(journal.pathname)
+        for full_report_filename in full_reports_filenames:
+            try:
+                os.remove(full_report_filename)
+            except Exception as e:
+                print(e, file=sys.stderr)
+        monitor.observe('total', time.perf_counter() - start)
+        return 0
+    except Exception as e:
+        print(e, file=sys.stderr)
+        return -1
+
+
+################################### Engine #########################################################
+
+class PhotoEvent:
+    """
+    Outcome of sorting a single photo, yielded by PhotoSorter.
+    Directories are indices in the directories table of the sorter, such that events do not hold full pathnames.
+    """
+    __slots__ = ('sorter', 'kind', 'old_directory', 'old_name', 'new_directory', 'new_name', 'size', 'mtime_ns')
+
+    def __init__(self, sorter:'PhotoSorter', kind:PhotoEventKind, old_directory:int, old_name:str, new_directory:int, new_name:str, size:int, mtime_ns:int) -> None:
+        self.sorter = sorter
+        self.kind = kind
+        self.old_directory = old_directory
+        self.old_name = old_name
+        self.new_directory = new_directory
+        self.new_name = new_name
+        self.size = size
+        self.mtime_ns = mtime_ns
+
+    @property
+    def old_pathname(self) -> str:
+        return os.path.join(self.sorter.directories[self.old_directory], self.old_name)
+
+    @property
+    def new_pathname(self) -> str:
+        return os.path.join(self.sorter.directories[self.new_directory], self.new_name)
+
+
+class PhotoSorter:
+    """
+    Sorts directories of photos, yielding a PhotoEvent per photo as soon as it is handled.
+    Memory is bounded by the photos of a single directory, the only ones whose new names can collide.
+    Geocoder and its cache stay warm between directories.
+    """
+    def __init__(self, use_gps:bool=False, suffix:str='', sort_by_dir:SortByDir=SortByDir.SORT_BY_NONE, datetime_fallback_os:bool=False, jobs:int=1, geocoder:Geocoder | None = None, geocoding_rate:float | None = None, use_index:bool=True,
+                 recursive:bool=False, include:list[str] | None = None, exclude:list[str] | None = None, monitor:Monitor | None = None, dedupe:str | None = None,
+                 date_sources:list[str] | None = None, output:str | None = None, verify_copies:bool=False) -> None:
+        """
+        @param geocoder used when use_gps is set, defaults to cached OpenStreetMap.
+        @param geocoding_rate maximum number of geocoding requests per second, defaults to the limit of the geocoder.
+        @param use_index whether metadata of photos is kept in PHOTOSORTER_SUBDIR, to skip unchanged photos on next runs.
+        @param recursive, include, exclude see scan_photos.
+        @param monitor collecting statistics and per-file messages.
+        @param dedupe 'report' to list photos of identical content, 'move' to also move copies to DUPLICATES_SUBDIR before sorting.
+        @param date_sources where dates of photos are looked for, see resolve_date_time.
+        @param output directory where photos are sorted instead of their own, possibly on another file system,
+        subdirectories being mirrored. New names already used there are numbered after the files using them.
+        @param verify_copies whether photos copied to another file system are checked by checksum before their removal.
+        """
+        self.use_gps = use_gps
+        self.suffix = suffix
+        self.sort_by_dir = sort_by_dir
+        self.datetime_fallback_os = datetime_fallback_os
+        self.jobs = jobs
+        self.geocoder = geocoder if geocoder is not None or not use_gps else default_geocoder()
+        self.geocoding_rate = geocoding_rate
+        self.use_index = use_index
+        self.recursive = recursive
+        self.include = include
+        self.exclude = exclude
+        self.monitor = monitor if monitor is not None else Monitor()
+        self.dedupe = dedupe
+        self.date_sources = date_sources
+        self.output = output
+        self.verify_copies = verify_copies
+        # Interned directories of events
+        self.directories = []
+        self.directory_ids = {}
+        self.cancelled = Event()
+
+    def cancel(self):
+        """
+        Stops the running job between two renames, and the jobs started afterwards, from any thread. Renames done are kept in the journal.
+        """
+        self.cancelled.set()
+
+    def check_directory(self, directory:str) -> bool:
+        """
+        @return whether given directory exists, reporting it as a failure otherwise.
+        """
+        if os.path.isdir(directory):
+            return True
+        self.monitor.error("Error : directory not found : " + directory, directory)
+        return False
+
+    def directory_id(self, directory:str) -> int:
+        directory_id = self.directory_ids.get(directory)
+        if directory_id is None:
+            directory_id = self.directory_ids[directory] = len(self.directories)
+            self.directories.append(directory)
+        return directory_id
+
+    def event(self, kind:PhotoEventKind, old_pathname:str, new_pathname:str, size:int, mtime_ns:int) -> PhotoEvent:
+        old_directory, old_name = os.path.split(old_pathname)
+        new_directory, new_name = os.path.split(new_pathname)
+        return PhotoEvent(self, kind, self.directory_id(old_directory), old_name, self.directory_id(new_directory), new_name, size, mtime_ns)
+
+    def plan_renames(self, directory:str, index:MetadataIndex | None, photo_pathnames:list[str] | None = None, number_after_existing:bool=False):
+        """
+        See plan_directory, new names being always numbered after existing ones when sorting into output.
+        """
+        return plan_directory(directory, self.use_gps, self.suffix, self.sort_by_dir, self.datetime_fallback_os, self.jobs, self.geocoder, self.geocoding_rate,
+                              index, self.recursive, self.include, self.exclude, self.monitor, self.cancelled, photo_pathnames, self.date_sources, self.output,
+                              number_after_existing or self.output is not None)
+
+    def apply_planned(self, planned_renames, journal:RenameJournal, index:MetadataIndex | None, produced:set | None = None):
+        """
+        Renames files as planned by plan_renames, yielding a RENAMED, UNCHANGED or FAILED event per photo.
+        @param produced if given, new names within the directory of the photo are added to it.
+        """
+        for renames in planned_renames:
+            for old_pathname, new_pathname, size, mtime_ns in renames:
+                if self.cancelled.is_set():
+                    return
+                if old_pathname == new_pathname:
+                    kind = PhotoEventKind.UNCHANGED
+                elif apply_rename(old_pathname, new_pathname, size, mtime_ns, journal, index, monitor=self.monitor, verify_copy=self.verify_copies):
+                    kind = PhotoEventKind.RENAMED
+                    if produced is not None and os.path.dirname(old_pathname) == os.path.dirname(new_pathname):
+                        produced.add(new_pathname)
+                else:
+                    kind = PhotoEventKind.FAILED
+                yield self.event(kind, old_pathname, new_pathname, size, mtime_ns)
+
+    def handle_duplicates(self, directory:str, journal:RenameJournal | None, index:MetadataIndex | None):
+        """
+        Reports copies of photos of given directory, and moves them to DUPLICATES_SUBDIR if journal is given,
+        yielding a DUPLICATE event per moved copy.
+        """
+        directory = os.path.abspath(directory)
+        with self.monitor.timer('dedupe_total'):
+            groups = find_duplicates(scan_photos(directory, self.recursive, self.include, self.exclude), self.jobs, self.monitor)
+        for original_pathname, *duplicate_pathnames in groups:
+            for duplicate_pathname in duplicate_pathnames:
+                if self.cancelled.is_set():
+                    return
+                self.monitor.count('duplicates')
+                self.monitor.emit('duplicate', pathname=duplicate_pathname, original=original_pathname)
+                if journal is None:
+                    self.monitor.log('Duplicate : ' + duplicate_pathname + ' == ' + original_pathname)
+                    continue
+                try:
+                    stat = os.stat(duplicate_pathname)
+                    # Relative path is kept, such that copies of different directories do not collide
+                    quarantine_pathname = next_free_pathname(os.path.join(directory, DUPLICATES_SUBDIR, os.path.relpath(duplicate_pathname, directory)))
+                    os.makedirs(os.path.dirname(quarantine_pathname), exist_ok=True)
+                    os.rename(duplicate_pathname, quarantine_pathname)
+                    if index is not None:
+                        index.rename(duplicate_pathname, quarantine_pathname)
+                    journal.record(duplicate_pathname, quarantine_pathname)
+                except Exception as e:
+                    self.monitor.error(e, duplicate_pathname)
+                    continue
+                self.monitor.log('Duplicate : ' + duplicate_pathname + ' -> ' + quarantine_pathname + ' (same as ' + original_pathname + ')')
+                yield self.event(PhotoEventKind.DUPLICATE, duplicate_pathname, quarantine_pathname, stat.st_size, stat.st_mtime_ns)
+
+    def plan(self, directory:str):
+        """
+        Yields a PLANNED or UNCHANGED event per photo of given directory, without modifying any file.
+        Duplicates are only reported, and the metadata index is only read if it exists.
+        """
+        if not self.check_directory(directory):
+            return
+        if self.dedupe is not None:
+            for _ in self.handle_duplicates(directory, None, None):
+                pass
+        index = open_metadata_index(directory, read_only=True) if self.use_index else None
+        try:
+            for renames in self.plan_renames(directory, index):
+                for old_pathname, new_pathname, size, mtime_ns in renames:
+                    yield self.event(PhotoEventKind.PLANNED if old_pathname != new_pathname else PhotoEventKind.UNCHANGED, old_pathname, new_pathname, size, mtime_ns)
+        finally:
+            if index is not None:
+                index.close()
+
+    def process(self, directory:str):
+        """
+        Sorts photos of given directory, yielding a RENAMED, UNCHANGED, FAILED or DUPLICATE event per photo.
+        Photos whose metadata cannot be read are reported to the monitor only.
+        """
+        if not self.check_directory(directory):
+            return
+        index = open_metadata_index(directory) if self.use_index else None
+        journal = RenameJournal(directory)
+        try:
+            with self.monitor.timer('total'):
+                # Moved copies are recorded in the same journal as renames, hence restored by revert
+                if self.dedupe is not None:
+                    yield from self.handle_duplicates(directory, journal if self.dedupe == 'move' else None, index)
+                # Each directory is renamed as soon as it is planned
+                yield from self.apply_planned(self.plan_renames(directory, index), journal, index)
+        finally:
+            # Renamed files must be recorded even if interrupted
+            journal.close()
+            if index is not None:
+                index.close()
+
+    def watch(self, directory:str, poll_interval:float | None = None, debounce:float = WATCH_DEBOUNCE):
+        """
+        Sorts photos of given directory, then the photos arriving in it until cancelled, yielding events as process does.
+        Photos are sorted once unchanged for debounce seconds, their new name being numbered after the files already using it.
+        All renames are appended to a single journal, synced after each batch.
+        @param poll_interval see open_directory_watcher.
+        """
+        directory = os.path.abspath(directory)
+        if not self.check_directory(directory):
+            return
+        scan_filter = ScanFilter(directory, self.include, self.exclude)
+        # Watched before the first pass, such that no photo arriving meanwhile is missed
+        watcher = open_directory_watcher(directory, self.recursive, scan_filter, poll_interval)
+        index = open_metadata_index(directory) if self.use_index else None
+        journal = RenameJournal(directory)
+        # New names given in watched directories, to be ignored when seen as arrivals
+        produced = set()
+        # Photos not sorted yet, to ((size, mtime_ns), time it was last seen changing)
+        pending = {}
+        try:
+            yield from self.apply_planned(self.plan_renames(directory, index, number_after_existing=True), journal, index, produced)
+            while not self.cancelled.is_set():
+                for pathname in watcher.wait(debounce / 2 if len(pending) != 0 else 1.0):
+                    if pathname in produced:
+                        produced.discard(pathname)
+                    elif scan_filter.is_photo(os.path.basename(pathname)):
+                        pending[pathname] = None
+                now = time.monotonic()
+                ready = []
+                for pathname, previous in list(pending.items()):
+                    try:
+                        stat = os.stat(pathname)
+                    except OSError:
+                        # Moved away or deleted
+                        del pending[pathname]
+                        continue
+                    signature = (stat.st_size, stat.st_mtime_ns)
+                    if previous is None or previous[0] != signature:
+                        pending[pathname] = (signature, now)
+                    elif now - previous[1] >= debounce and len(ready) < WATCH_BATCH_SIZE:
+                        ready.append(pathname)
+                        del pending[pathname]
+                if len(ready) == 0:
+                    continue
+                # Grouped by directory as expected by plan_directory
+                ready.sort(key=lambda pathname: (os.path.dirname(pathname), pathname))
+                with self.monitor.timer('watch_batch'):
+                    yield from self.apply_planned(self.plan_renames(directory, index, ready, number_after_existing=True), journal, index, produced)
+                if journal.file is not None:
+                    journal.sync()
+        finally:
+            watcher.close()
+            journal.close()
+            if index is not None:
+                index.close()
+
+    def write_plan(self, plan_pathname:str, directory:str) -> int:
+        """
+        See write_plan.
+        """
+        directory = os.path.abspath(directory)
+        renamed_count = 0
+        with open(plan_pathname, 'w', encoding='utf-8') as plan_file:
+            plan_file.write(json.dumps({'type':'plan', 'version':JOURNAL_VERSION, 'directory':directory}, ensure_ascii=False, separators=(',', ':')) + '\n')
+            for event in self.plan(directory):
+                if event.kind != PhotoEventKind.PLANNED:
+                    continue
+                old_pathname, new_pathname = event.old_pathname, event.new_pathname
+                plan_file.write(json.dumps({'type':'rename', 'old':journal_path(old_pathname, directory), 'new':journal_path(new_pathname, directory), 'size':event.size, 'mtime_ns':event.mtime_ns}, ensure_ascii=False, separators=(',', ':')) + '\n')
+                self.monitor.log('Planned : ' + old_pathname + ' -> ' + new_pathname)
+                self.monitor.emit('planned', old=old_pathname, new=new_pathname)
+                renamed_count += 1
+        return renamed_count
+
+    def revert(self, directory:str) -> int:
+        """
+        See revert_directory.
+        """
+        return revert_directory(directory, self.jobs, self.monitor, self.cancelled)
+
+
+# PhotoSorter of each process of process_roots, kept between roots
+pool_sorter = None
+
+
+def init_pool_worker(sorter_args:tuple, sorter_kwargs:dict, geocoder_args:tuple | None, processes:int, quiet:bool):
+    global pool_sorter
+    geocoder = default_geocoder(*geocoder_args) if geocoder_args is not None else None
+    geocoding_rate = sorter_kwargs.pop('geocoding_rate', None)
+    if geocoder is not None:
+        # Processes share the rate limit of the geocoder
+        geocoding_rate = geocoding_rate if geocoding_rate is not None else geocoder.requests_per_second
+        if geocoding_rate:
+            geocoding_rate /= processes
+    pool_sorter = PhotoSorter(*sorter_args, geocoder=geocoder, geocoding_rate=geocoding_rate, monitor=Monitor(quiet), **sorter_kwargs)
+
+
+def run_pool_root(root:str, revert:bool) -> tuple:
+    """
+    Sorts or reverts given root in a process of process_roots.
+    @return result as returned by revert_directory (0 when sorted), counters and timers of its monitor, error message or None.
+    """
+    monitor = Monitor(pool_sorter.monitor.quiet)
+    pool_sorter.monitor = monitor
+    try:
+        if not os.path.isdir(root):
+            raise NotADirectoryError('Not a directory : ' + root)
+        if revert:
+            result = pool_sorter.revert(root)
+        else:
+            for _ in pool_sorter.process(root):
+                pass
+            result = 0
+        error = None
+    except Exception as e:
+        result = -1
+        error = f'{type(e).__name__}: {e}'
+    return result, monitor.counters, monitor.timers, error
+
+
+def run_isolated_root(root:str, revert:bool, initargs:tuple) -> tuple:
+    """
+    Sorts or reverts given root in a process of its own, such that it is the only one failing if this process dies.
+    @return see run_pool_root.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    try:
+        with ProcessPoolExecutor(max_workers=1, initializer=init_pool_worker, initargs=initargs) as executor:
+            return executor.submit(run_pool_root, root, revert).result()
+    except Exception as e:
+        return -1, {}, {}, f'{type(e).__name__}: {e}'
+
+
+def process_roots(roots:list[str], processes:int, revert:bool, sorter_args:tuple = (), sorter_kwargs:dict | None = None, geocoder_args:tuple | None = None, monitor:Monitor | None = None) -> int:
+    """
+    Sorts or reverts several directories in a pool of processes, each directory getting its own report.
+    Directories are handed to processes as they become idle, and a failing directory does not stop the others.
+    If a process dies, breaking the pool, the unfinished directories are run again, each in a process of its own.
+    @param sorter_args, sorter_kwargs arguments of the PhotoSorter of each process, except geocoder and monitor.
+    @param geocoder_args arguments of default_geocoder, None to not use GPS.
+    @param monitor merging the statistics of all directories.
+    @return number of directories that failed.
+    """
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+    from concurrent.futures.process import BrokenProcessPool
+    if monitor is None:
+        monitor = Monitor()
+    results = {}
+    initargs = (sorter_args, dict(sorter_kwargs or {}), geocoder_args, processes, monitor.quiet)
+    with ProcessPoolExecutor(max_workers=processes, initializer=init_pool_worker, initargs=initargs) as executor:
+        futures = {executor.submit(run_pool_root, root, revert):root for root in roots}
+        for future in as_completed(futures):
+            try:
+                result, counters, timers, error = future.result()
+            except BrokenProcessPool:
+                # A process died, failing every unfinished directory, not only its own
+                continue
+            except Exception as e:
+                result, counters, timers, error = -1, {}, {}, f'{type(e).__name__}: {e}'
+            monitor.merge(counters, timers)
+            results[futures[future]] = (result, counters, error)
+
+    unfinished_roots = [root for root in roots if root not in results]
+    if len(unfinished_roots) != 0:
+        print(f'A process died, running {len(unfinished_roots)} unfinished directories again', file=sys.stderr)
+        monitor.count('pool_restarts')
+        with ThreadPoolExecutor(max_workers=processes) as executor:
+            for root, (result, counters, timers, error) in zip(unfinished_roots, executor.map(lambda root: run_isolated_root(root, revert, initargs), unfinished_roots)):
+                monitor.merge(counters, timers)
+                results[root] = (result, counters, error)
+
+    failed_count = 0
+    print(f'Summary : {len(roots)} directories')
+    for root in roots:
+        result, counters, error = results[root]
+        if error is not None or result == -1:
+            status = 'failed (' + (error if error is not None else 'see errors above') + ')'
+        elif result == 1:
+            status = 'nothing to revert'
+        elif revert:
+            status = f'{counters.get("restored", 0)} restored'
+        else:
+            status = f'{counters.get("renames", 0)} renamed'
+        if counters.get('failures', 0) != 0:
+            status += f', {counters["failures"]} failures'
+        if error is not None or result == -1 or counters.get('failures', 0) != 0:
+            failed_count += 1
+        print('  ' + root + ' : ' + status)
+    print(f'{len(roots) - failed_count} succeeded, {failed_count} failed')
+    return failed_count
+
+
+################################### Main ###########################################################
+
+def main() -> int:
+    argparser = argparse.ArgumentParser(description='Renames and moves pictures in a directory using their EXIF data.', epilog='If no arguments provided, the interface is launched.')
+    argparser.add_argument('directory', help='Paths to directories to be processed.', type=str, nargs='*')
+    argparser.add_argument('--roots-file', help='Processes the directories listed in given file too, one per line.', metavar='FILE')
+    #argparser.add_argument('-g', '--gui', help='Starts User Interface', action='store_true')
+    argparser.add_argument('-G', '--gps', help='Uses GPS data to rename files.', action='store_true')
+    argparser.add_argument('-s', '--suffix', help='Adds given suffix to each file.')
+    argparser.add_argument('-R', '--revert', help='Reverts given directory to original state.', action='store_true')
+    #option_group = argparser.add_mutually_exclusive_group(required=False)
+    argparser.add_argument('-m', '--month', help='Classify files by month.', action='store_true')
+    argparser.add_argument('-y', '--year', help='Classify files by year.', action='store_true')
+    argparser.add_argument('-d', '--datetime_fallback', help='Fallback to date of file creation if EXIF is absent.', action='store_true')
+    argparser.add_argument('--date-sources', help='Comma separated sources of dates, tried in order, among ' + ','.join(ALL_DATE_SOURCES) + ' (default ' + ','.join(DATE_SOURCES) + ').', type=parse_date_sources)
+    argparser.add_argument('--gps-precision', help='Decimals of GPS coordinates sharing a cached location (default 3, about 100m).', type=int, default=3)
+    argparser.add_argument('--no-gps-cache', help='Do not use the cache of GPS locations.', action='store_true')
+    argparser.add_argument('--gps-rate', help='Maximum number of GPS location requests per second (default 1 for OpenStreetMap).', type=float)
+    argparser.add_argument('--gazetteer', help='Offline GPS locations from a GeoNames-like file of places, such as cities1000.txt.')
+    argparser.add_argument('--countries', help='GeoNames countryInfo.txt file giving country names of --gazetteer places.')
+    argparser.add_argument('--no-index', help='Do not keep metadata of photos to skip unchanged photos on next runs.', action='store_true')
+    argparser.add_argument('-r', '--recursive', help='Processes subdirectories too, except already sorted ones.', action='store_true')
+    argparser.add_argument('-i', '--include', help='Processes only files matching this pattern, such as "IMG_*.jpg" (default photos and videos of jpg, heic, png, mp4 and mov formats). Can be repeated.', action='append')
+    argparser.add_argument('-x', '--exclude', help='Skips files and directories matching this pattern. Can be repeated.', action='append')
+    argparser.add_argument('--plan-out', help='Writes how files would be renamed to given file, without renaming them.', metavar='FILE')
+    argparser.add_argument('--apply', help='Renames files as planned in given file (see --plan-out), directory defaulting to the planned one.', metavar='FILE')
+    argparser.add_argument('-o', '--output', help='Sorts photos into given directory, possibly on another file system, instead of their own.', metavar='DIR')
+    argparser.add_argument('--verify', help='With --output on another file system, checks each copy by checksum before removing the original.', action='store_true')
+    argparser.add_argument('--dedupe', help='Finds photos of identical content, and lists them (report) or moves copies to a "duplicates" subdirectory (move).', choices=['report', 'move'])
+    argparser.add_argument('-w', '--watch', help='Keeps sorting photos arriving in directory, until interrupted.', action='store_true')
+    argparser.add_argument('--poll-interval', help='With --watch, looks for new photos every given seconds instead of using inotify, such as for network file systems.', type=float, metavar='SECONDS')
+    argparser.add_argument('-j', '--jobs', help='Number of photos processed in parallel.', type=int, default=1)
+    argparser.add_argument('-P', '--processes', help='Number of directories processed in parallel when several are given (default number of CPUs).', type=int)
+    argparser.add_argument('-q', '--quiet', help='Does not print a message per file, errors excepted.', action='store_true')
+    argparser.add_argument('--stats', help='Writes counters and time spent per stage as JSON to given file, "-" for standard error.', metavar='FILE')
+    argparser.add_argument('--profile', help='Writes a cProfile dump of the run to given file, see the pstats module.', metavar='FILE')
+    args = argparser.parse_args()
+    roots = args.directory + (read_roots_file(args.roots_file) if args.roots_file is not None else [])
+    if len(roots) > 1 and (args.plan_out is not None or args.watch or args.apply is not None):
+        argparser.error('--plan-out, --apply and --watch take a single directory')
+    if len(roots) > 1 and args.output is not None:
+        # Processes would number names of the same output directory independently
+        argparser.error('--output takes a single directory')
+
+    monitor = Monitor(args.quiet)
+    profiler = None
+    if args.profile is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    status = 1
+    try:
+        status = run(args, roots, monitor)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if args.stats is not None:
+            if args.stats == '-':
+                json.dump(monitor.to_dict(), sys.stderr, indent=4)
+                print(file=sys.stderr)
+            else:
+                with open(args.stats, 'w', encoding='utf-8') as stats_file:
+                    json.dump(monitor.to_dict(), stats_file, indent=4)
+    return status
+
+
+def parse_date_sources(text:str) -> list[str]:
+    date_sources = [date_source.strip() for date_source in text.split(',') if date_source.strip() != '']
+    for date_source in date_sources:
+        if date_source not in ALL_DATE_SOURCES:
+            raise argparse.ArgumentTypeError(f'unknown date source {date_source}, expected among ' + ','.join(ALL_DATE_SOURCES))
+    return date_sources
+
+
+def read_roots_file(roots_pathname:str) -> list[str]:
+    """
+    @return directories listed in given file, one per line, ignoring empty lines and lines starting with #.
+    """
+    with open(roots_pathname, encoding='utf-8') as roots_file:
+        return [line.strip() for line in roots_file if line.strip() != '' and not line.lstrip().startswith('#')]
+
+
+def run(args:argparse.Namespace, roots:list[str], monitor:Monitor) -> int:
+    """
+    @return exit status, 1 if any file or directory failed.
+    """
+    if args.apply is not None:
+        apply_plan(args.apply, roots[0] if len(roots) != 0 else None, monitor)
+    elif len(roots) != 0:
+        suffix = '' if args.suffix is None else args.suffix
+        sort_by_dir = SortByDir.SORT_BY_NONE
+        if args.year and args.month:
+            sort_by_dir = SortByDir.SORT_BY_YEAR_AND_MONTH
+        elif args.year:
+            sort_by_dir = SortByDir.SORT_BY_YEAR
+        elif args.month:
+            sort_by_dir = SortByDir.SORT_BY_MONTH
+        geocoder_args = (not args.no_gps_cache, args.gps_precision, args.gazetteer, args.countries) if args.gps else None
+        sorter_args = (args.gps, suffix, sort_by_dir, args.datetime_fallback, args.jobs)
+        sorter_kwargs = dict(geocoding_rate=args.gps_rate, use_index=not args.no_index, recursive=args.recursive, include=args.include, exclude=args.exclude, dedupe=args.dedupe,
+                             date_sources=args.date_sources, output=args.output, verify_copies=args.verify)
+        if args.revert:
+            sorter_args, sorter_kwargs, geocoder_args = (), dict(jobs=args.jobs), None
+        if len(roots) > 1:
+            processes = min(len(roots), args.processes if args.processes is not None else os.cpu_count() or 1)
+            return 1 if process_roots(roots, processes, args.revert, sorter_args, sorter_kwargs, geocoder_args, monitor) != 0 else 0
+        directory = roots[0]
+        if args.revert:
+            # Same rule as process_roots : nothing to revert is not a failure
+            if PhotoSorter(jobs=args.jobs, monitor=monitor).revert(directory) == -1:
+                return 1
+        else:
+            geocoder = default_geocoder(*geocoder_args) if geocoder_args is not None else None
+            sorter = PhotoSorter(*sorter_args, geocoder=geocoder, monitor=monitor, **sorter_kwargs)
+            if args.plan_out is not None:
+                sorter.write_plan(args.plan_out, directory)
+            elif args.watch:
+                try:
+                    for _ in sorter.watch(directory, args.poll_interval):
+                        pass
+                except KeyboardInterrupt:
+                    pass
+            else:
+                for _ in sorter.process(directory):
+                    pass
+    else:
+        start_gui()
+        return 0
+    return 1 if monitor.counters.get('failures', 0) != 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
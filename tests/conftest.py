@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Tests import photosorter_core and the benchmark helpers from the repository root
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, 'benchmarks'))
@@ -0,0 +1,229 @@
+import json
+import os
+import time
+from concurrent.futures import CancelledError
+from threading import Event, Lock, Thread
+
+import pytest
+
+import photosorter_core as photosorter
+from pipeline import exif_block, start_nominatim_stub, write_jpeg
+
+
+class StubGeocoder(photosorter.Geocoder):
+    """
+    Records requested coordinates and their time, failing the first given number of requests.
+    """
+    def __init__(self, failures:int = 0, requests_per_second:float | None = None) -> None:
+        self.failures = failures
+        self.requests_per_second = requests_per_second
+        self.requests = []
+        self.request_times = []
+        self.lock = Lock()
+
+    def reverse(self, latitude:float, longitude:float) -> tuple[str, str]:
+        with self.lock:
+            self.requests.append((latitude, longitude))
+            self.request_times.append(time.monotonic())
+            if self.failures > 0:
+                self.failures -= 1
+                raise OSError('Service unavailable')
+        return f'Country{int(latitude)}', f'Town{latitude:.3f}_{longitude:.3f}'
+
+
+################################### CachedGeocoder #################################################
+
+def test_cached_geocoder_quantizes_coordinates():
+    stub = StubGeocoder()
+    geocoder = photosorter.CachedGeocoder(stub, precision=3)
+    assert geocoder.reverse(48.85661, 2.35222) == geocoder.reverse(48.85651, 2.35218)
+    # Quantized coordinates are queried, such that the result does not depend on the first photo
+    assert stub.requests == [(48.857, 2.352)]
+    geocoder.reverse(48.8551, 2.3522)
+    assert len(stub.requests) == 2
+
+
+def test_cached_geocoder_precision():
+    stub = StubGeocoder()
+    geocoder = photosorter.CachedGeocoder(stub, precision=1)
+    assert geocoder.key(48.8566, 2.3522) == '48.9,2.4'
+    geocoder.reverse(48.86, 2.35)
+    geocoder.reverse(48.87, 2.36)
+    assert stub.requests == [(48.9, 2.4)]
+
+
+def test_cached_geocoder_evicts_least_recently_used():
+    stub = StubGeocoder()
+    geocoder = photosorter.CachedGeocoder(stub, max_entries=2)
+    geocoder.reverse(1.0, 1.0)
+    geocoder.reverse(2.0, 2.0)
+    # Using the first entry again makes the second one the least recently used
+    geocoder.reverse(1.0, 1.0)
+    geocoder.reverse(3.0, 3.0)
+    assert list(geocoder.entries) == ['1.000,1.000', '3.000,3.000']
+    assert geocoder.peek(2.0, 2.0) is None
+    geocoder.reverse(1.0, 1.0)
+    assert len(stub.requests) == 3
+
+
+def test_cached_geocoder_reloads_saved_cache(tmp_path):
+    cache_pathname = str(tmp_path / 'cache' / photosorter.GEOCODING_CACHE_FILENAME)
+    stub = StubGeocoder()
+    geocoder = photosorter.CachedGeocoder(stub, cache_pathname)
+    location = geocoder.reverse(45.764, 4.8357)
+    geocoder.save()
+    assert not geocoder.modified
+    with open(cache_pathname) as cache_file:
+        assert json.load(cache_file) == {'45.764,4.836': list(location)}
+
+    reloaded_stub = StubGeocoder()
+    reloaded = photosorter.CachedGeocoder(reloaded_stub, cache_pathname)
+    assert reloaded.peek(45.764, 4.8357) == location
+    assert reloaded.reverse(45.764, 4.8357) == location
+    assert reloaded_stub.requests == []
+
+
+def test_cached_geocoder_ignores_corrupt_cache(tmp_path, capsys):
+    cache_pathname = tmp_path / photosorter.GEOCODING_CACHE_FILENAME
+    cache_pathname.write_text('{"45.764,4.836": ')
+    geocoder = photosorter.CachedGeocoder(StubGeocoder(), str(cache_pathname))
+    assert len(geocoder.entries) == 0
+    assert capsys.readouterr().err
+
+
+################################### GeocodingScheduler #############################################
+
+def test_scheduler_requests_each_key_once():
+    stub = StubGeocoder()
+    monitor = photosorter.Monitor(quiet=True)
+    scheduler = photosorter.GeocodingScheduler(photosorter.CachedGeocoder(stub), workers=4, monitor=monitor)
+    coordinates = [(10.0001, 20.0001), (10.0002, 20.0002), (30.0, 40.0)] * 10
+    futures = [scheduler.submit(latitude, longitude) for latitude, longitude in coordinates]
+    locations = [future.result() for future in futures]
+    scheduler.close()
+    assert sorted(stub.requests) == [(10.0, 20.0), (30.0, 40.0)]
+    assert locations[0] == locations[1] != locations[2]
+    assert monitor.counters['geocoder_cache_misses'] == 2
+    assert monitor.counters['geocoder_cache_hits'] == 28
+
+
+def test_scheduler_uses_cached_locations_without_request():
+    stub = StubGeocoder()
+    geocoder = photosorter.CachedGeocoder(stub)
+    location = geocoder.reverse(10.0, 20.0)
+    scheduler = photosorter.GeocodingScheduler(geocoder, monitor=photosorter.Monitor(quiet=True))
+    assert scheduler.submit(10.0, 20.0).result() == location
+    scheduler.close()
+    assert len(stub.requests) == 1
+
+
+def test_scheduler_spaces_requests():
+    stub = StubGeocoder(requests_per_second=20.0)
+    start = time.monotonic()
+    scheduler = photosorter.GeocodingScheduler(stub, workers=4, monitor=photosorter.Monitor(quiet=True))
+    futures = [scheduler.submit(float(latitude), 0.0) for latitude in range(6)]
+    for future in futures:
+        future.result()
+    scheduler.close()
+    # Requests are booked 50ms apart, threads possibly waking up late
+    for number, request_time in enumerate(sorted(stub.request_times)):
+        assert request_time - start >= number * 0.05
+    assert time.monotonic() - start < 1.0
+
+
+def test_scheduler_overrides_requests_per_second():
+    stub = StubGeocoder(requests_per_second=1.0)
+    scheduler = photosorter.GeocodingScheduler(stub, requests_per_second=0, monitor=photosorter.Monitor(quiet=True))
+    start = time.monotonic()
+    futures = [scheduler.submit(float(latitude), 0.0) for latitude in range(4)]
+    for future in futures:
+        future.result()
+    scheduler.close()
+    assert time.monotonic() - start < 1.0
+
+
+def test_scheduler_retries_with_backoff(capsys):
+    stub = StubGeocoder(failures=2)
+    monitor = photosorter.Monitor(quiet=True)
+    scheduler = photosorter.GeocodingScheduler(stub, workers=1, max_retries=3, backoff=0.05, monitor=monitor)
+    assert scheduler.submit(1.0, 2.0).result() == ('Country1', 'Town1.000_2.000')
+    scheduler.close()
+    assert monitor.counters['geocoding_retries'] == 2
+    # Waits of 0.05s then 0.1s
+    first, second, third = stub.request_times
+    assert second - first >= 0.045
+    assert third - second >= 0.095
+    assert 'retrying' in capsys.readouterr().err
+
+
+def test_scheduler_gives_up_after_max_retries(capsys):
+    stub = StubGeocoder(failures=10)
+    scheduler = photosorter.GeocodingScheduler(stub, max_retries=2, backoff=0.0, monitor=photosorter.Monitor(quiet=True))
+    with pytest.raises(OSError):
+        scheduler.submit(1.0, 2.0).result()
+    scheduler.close()
+    assert len(stub.requests) == 3
+
+
+def test_scheduler_abandons_waiting_requests_once_cancelled():
+    stub = StubGeocoder(requests_per_second=2.0)
+    cancel = Event()
+    scheduler = photosorter.GeocodingScheduler(stub, workers=4, monitor=photosorter.Monitor(quiet=True), cancel=cancel)
+    futures = [scheduler.submit(float(latitude), 0.0) for latitude in range(40)]
+    time.sleep(0.2)
+    cancel.set()
+    start = time.monotonic()
+    scheduler.close()
+    assert time.monotonic() - start < 0.5
+    assert len(stub.requests) < 40
+    for future in futures[len(stub.requests):]:
+        with pytest.raises(CancelledError):
+            future.result()
+
+
+def test_scheduler_abandons_retries_once_cancelled(capsys):
+    stub = StubGeocoder(failures=1)
+    cancel = Event()
+    scheduler = photosorter.GeocodingScheduler(stub, backoff=60.0, monitor=photosorter.Monitor(quiet=True), cancel=cancel)
+    future = scheduler.submit(1.0, 2.0)
+    time.sleep(0.1)
+    cancel.set()
+    with pytest.raises(CancelledError):
+        future.result(timeout=0.5)
+    scheduler.close()
+    assert len(stub.requests) == 1
+
+
+def test_cancelled_sort_does_not_wait_for_locations(tmp_path):
+    for number in range(20):
+        write_jpeg(str(tmp_path / f'IMG_{number:04d}.jpg'), exif_block('2021:06:15 10:20:30', None, (float(number), 2.0)), 100)
+    stub = StubGeocoder(requests_per_second=2.0)
+    sorter = photosorter.PhotoSorter(use_gps=True, geocoder=stub, use_index=False, monitor=photosorter.Monitor(quiet=True))
+    thread = Thread(target=lambda: list(sorter.process(str(tmp_path))))
+    thread.start()
+    time.sleep(0.3)
+    sorter.cancel()
+    start = time.monotonic()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert time.monotonic() - start < 1.0
+    assert len(stub.requests) < 20
+    # Nothing renamed once cancelled while planning
+    assert sorted(filename for filename in os.listdir(tmp_path) if filename.endswith('.jpg')) == [f'IMG_{number:04d}.jpg' for number in range(20)]
+
+
+################################### NominatimGeocoder ##############################################
+
+def test_nominatim_geocoder_with_stub_server():
+    server = start_nominatim_stub()
+    try:
+        geocoder = photosorter.CachedGeocoder(
+            photosorter.NominatimGeocoder(domain=f'127.0.0.1:{server.server_port}', scheme='http'))
+        scheduler = photosorter.GeocodingScheduler(geocoder, requests_per_second=0, monitor=photosorter.Monitor(quiet=True))
+        futures = [scheduler.submit(12.3456, 45.6789), scheduler.submit(12.3457, 45.6788)]
+        assert [future.result() for future in futures] == [('Country1', 'Town12_45')] * 2
+        scheduler.close()
+        assert list(geocoder.entries) == ['12.346,45.679']
+    finally:
+        server.shutdown()
+        server.server_close()
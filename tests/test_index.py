@@ -0,0 +1,39 @@
+import os
+
+import photosorter_core as photosorter
+from pipeline import exif_block, write_jpeg
+
+
+def index_pathname(directory) -> str:
+    return os.path.join(directory, photosorter.PHOTOSORTER_SUBDIR, photosorter.METADATA_INDEX_FILENAME)
+
+
+def test_missing_directory_is_reported_not_created(tmp_path):
+    monitor = photosorter.Monitor(quiet=True)
+    sorter = photosorter.PhotoSorter(monitor=monitor)
+    assert list(sorter.process(str(tmp_path / 'typo'))) == []
+    assert list(sorter.plan(str(tmp_path / 'typo'))) == []
+    assert os.listdir(tmp_path) == []
+    assert monitor.counters['failures'] == 2
+
+
+def test_index_is_created_on_first_write(tmp_path):
+    (tmp_path / 'notes.txt').write_text('not a photo')
+    list(photosorter.PhotoSorter(monitor=photosorter.Monitor(quiet=True)).process(str(tmp_path)))
+    assert os.listdir(tmp_path) == ['notes.txt']
+
+    write_jpeg(str(tmp_path / 'IMG_0001.jpg'), exif_block('2021:06:15 10:20:30', None, None), 100)
+    list(photosorter.PhotoSorter(monitor=photosorter.Monitor(quiet=True)).process(str(tmp_path)))
+    assert os.path.isfile(index_pathname(tmp_path))
+    monitor = photosorter.Monitor(quiet=True)
+    list(photosorter.PhotoSorter(monitor=monitor).process(str(tmp_path)))
+    assert monitor.counters['index_hits'] == 1
+
+
+def test_index_without_entries_ignores_updates(tmp_path):
+    index = photosorter.MetadataIndex(index_pathname(tmp_path))
+    index.rename(str(tmp_path / 'a.jpg'), str(tmp_path / 'b.jpg'))
+    index.set_location(str(tmp_path / 'b.jpg'), 'France', 'Paris')
+    assert index.get(str(tmp_path / 'b.jpg'), os.stat(tmp_path)) is None
+    index.close()
+    assert os.listdir(tmp_path) == []
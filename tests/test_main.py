@@ -0,0 +1,39 @@
+import sys
+
+import photosorter_core as photosorter
+from pipeline import exif_block, write_jpeg
+
+
+def run_main(monkeypatch, *arguments) -> int:
+    monkeypatch.setattr(sys, 'argv', ['photosorter.py', '--quiet', *arguments])
+    return photosorter.main()
+
+
+def write_photo(pathname):
+    pathname.parent.mkdir(parents=True, exist_ok=True)
+    write_jpeg(str(pathname), exif_block('2021:06:15 10:20:30', None, None), 100)
+
+
+def test_exit_status_of_a_single_directory(tmp_path, monkeypatch):
+    write_photo(tmp_path / 'photos' / 'IMG_0001.jpg')
+    assert run_main(monkeypatch, str(tmp_path / 'photos')) == 0
+    assert run_main(monkeypatch, str(tmp_path / 'photos'), '--revert') == 0
+    # Nothing to revert is not a failure
+    assert run_main(monkeypatch, str(tmp_path / 'photos'), '--revert') == 0
+    assert run_main(monkeypatch, str(tmp_path / 'missing')) == 1
+
+
+def test_exit_status_of_failed_files(tmp_path, monkeypatch):
+    photos_dir = tmp_path / 'photos'
+    write_photo(photos_dir / 'IMG_0001.jpg')
+    assert run_main(monkeypatch, str(photos_dir)) == 0
+    # Original name taken since sorted
+    (photos_dir / 'IMG_0001.jpg').write_bytes(b'other')
+    assert run_main(monkeypatch, str(photos_dir), '--revert') == 1
+
+
+def test_exit_status_is_the_same_for_several_directories(tmp_path, monkeypatch):
+    write_photo(tmp_path / 'first' / 'IMG_0001.jpg')
+    write_photo(tmp_path / 'second' / 'IMG_0001.jpg')
+    assert run_main(monkeypatch, str(tmp_path / 'first'), str(tmp_path / 'second'), '--processes', '1') == 0
+    assert run_main(monkeypatch, str(tmp_path / 'first'), str(tmp_path / 'missing'), '--processes', '1') == 1
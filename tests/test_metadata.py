@@ -0,0 +1,191 @@
+import os
+import struct
+import sys
+import zlib
+from datetime import datetime, timezone
+
+import pytest
+
+import photosorter_core as photosorter
+from pipeline import exif_block, write_jpeg
+
+
+def box(box_type:bytes, content:bytes) -> bytes:
+    return struct.pack('>I4s', 8 + len(content), box_type) + content
+
+
+def full_box(box_type:bytes, version:int, content:bytes) -> bytes:
+    return box(box_type, bytes([version, 0, 0, 0]) + content)
+
+
+def png_chunk(chunk_type:bytes, content:bytes) -> bytes:
+    return struct.pack('>I4s', len(content), chunk_type) + content + struct.pack('>I', zlib.crc32(chunk_type + content))
+
+
+def isobmff_seconds(date_time:datetime) -> int:
+    return int((date_time - photosorter.ISOBMFF_EPOCH).total_seconds())
+
+
+def write_png(pathname, chunks:list[bytes]):
+    pathname.write_bytes(photosorter.PNG_SIGNATURE + png_chunk(b'IHDR', bytes(13)) + b''.join(chunks) + png_chunk(b'IEND', b''))
+
+
+def write_heif(pathname, tiff:bytes, iinf_version:int, infe_version:int, iloc_version:int):
+    """
+    Writes a HEIF file made of an image item and an Exif item, located by the iinf and iloc boxes of given versions.
+    """
+    item = struct.pack('>I', 0) + tiff
+    def infe(item_id:int, item_type:bytes) -> bytes:
+        return full_box(b'infe', infe_version, item_id.to_bytes(2 if infe_version == 2 else 4, 'big') + b'\0\0' + item_type + b'\0')
+    iinf = full_box(b'iinf', iinf_version, (2).to_bytes(2 if iinf_version == 0 else 4, 'big') + infe(1, b'hvc1') + infe(2, b'Exif'))
+    def iloc(exif_offset:int) -> bytes:
+        id_size = 2 if iloc_version < 2 else 4
+        # 4 bytes offsets and lengths, 4 bytes base offsets
+        content = bytes([0x44, 0x40]) + (2).to_bytes(id_size, 'big')
+        for item_id, base_offset, offset, length in ((1, 0, 0, 10), (2, exif_offset - 8, 8, len(item))):
+            content += item_id.to_bytes(id_size, 'big')
+            if iloc_version in (1, 2):
+                # Construction method
+                content += struct.pack('>H', 0)
+            content += struct.pack('>HIH', 0, base_offset, 1) + struct.pack('>II', offset, length)
+        return full_box(b'iloc', iloc_version, content)
+    ftyp = box(b'ftyp', b'heic\0\0\0\0mif1heic')
+    def meta(exif_offset:int) -> bytes:
+        return full_box(b'meta', 0, full_box(b'hdlr', 0, bytes(20)) + iinf + iloc(exif_offset))
+    exif_offset = len(ftyp) + len(meta(8)) + 8
+    pathname.write_bytes(ftyp + meta(exif_offset) + box(b'mdat', item + bytes(5000)))
+
+
+################################### PNG ############################################################
+
+def test_png_time_chunk(tmp_path):
+    pathname = tmp_path / 'screenshot.png'
+    write_png(pathname, [png_chunk(b'IDAT', bytes(10000)), png_chunk(b'tIME', struct.pack('>HBBBBB', 2022, 3, 4, 5, 6, 7))])
+    with open(pathname, 'rb') as file:
+        tiff, tags = photosorter.read_png_metadata(file)
+    assert tiff is None
+    # Date in UTC, given in local time as in EXIF
+    assert tags == {'Image DateTime': photosorter.utc_to_exif_datetime(datetime(2022, 3, 4, 5, 6, 7, tzinfo=timezone.utc))}
+
+
+def test_png_exif_chunk_has_precedence(tmp_path):
+    pathname = tmp_path / 'photo.PNG'
+    tiff = exif_block('2021:02:03 04:05:06', '12', None)
+    write_png(pathname, [png_chunk(b'tIME', struct.pack('>HBBBBB', 2022, 3, 4, 5, 6, 7)), png_chunk(b'eXIf', tiff), png_chunk(b'IDAT', bytes(1000))])
+    with open(pathname, 'rb') as file:
+        assert photosorter.read_png_metadata(file)[0] == tiff
+    tags = photosorter.read_exif_tags(str(pathname))
+    assert tags['Image DateTime'] == '2021:02:03 04:05:06'
+
+
+def test_png_without_metadata(tmp_path):
+    pathname = tmp_path / 'drawing.png'
+    write_png(pathname, [png_chunk(b'IDAT', bytes(1000))])
+    with open(pathname, 'rb') as file:
+        assert photosorter.read_png_metadata(file) == (None, {})
+
+
+################################### MP4 and MOV ####################################################
+
+def test_mp4_with_large_media_data(tmp_path):
+    creation = datetime(2020, 7, 8, 9, 10, 11, tzinfo=timezone.utc)
+    pathname = tmp_path / 'clip.mp4'
+    media_size = 5 * 1024**3
+    with open(pathname, 'wb') as file:
+        file.write(box(b'ftyp', b'isom\0\0\0\0isom'))
+        # 64-bit size, sparse content
+        file.write(struct.pack('>I4sQ', 1, b'mdat', media_size + 16))
+        file.seek(media_size, os.SEEK_CUR)
+        file.write(box(b'moov', full_box(b'mvhd', 0, struct.pack('>II', isobmff_seconds(creation), isobmff_seconds(creation)) + bytes(88))))
+    tags = photosorter.read_exif_tags(str(pathname))
+    assert tags == {'EXIF DateTimeOriginal': photosorter.utc_to_exif_datetime(creation)}
+
+
+def test_mov_with_version_1_movie_header(tmp_path):
+    creation = datetime(2012, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+    pathname = tmp_path / 'old.MOV'
+    # Old QuickTime files start with a wide box
+    mvhd = full_box(b'mvhd', 1, struct.pack('>QQ', isobmff_seconds(creation), isobmff_seconds(creation) + 60) + bytes(88))
+    pathname.write_bytes(box(b'wide', b'') + box(b'mdat', bytes(5000)) + box(b'moov', box(b'udta', b'') + mvhd))
+    with open(pathname, 'rb') as file:
+        assert photosorter.read_isobmff_metadata(file) == (None, {'EXIF DateTimeOriginal': photosorter.utc_to_exif_datetime(creation)})
+
+
+def test_mov_with_unknown_creation_time(tmp_path):
+    pathname = tmp_path / 'clip.mov'
+    pathname.write_bytes(box(b'ftyp', b'qt  \0\0\0\0qt  ') + box(b'moov', full_box(b'mvhd', 0, bytes(96))))
+    with open(pathname, 'rb') as file:
+        assert photosorter.read_isobmff_metadata(file) == (None, {})
+
+
+def test_invalid_box_size(tmp_path):
+    pathname = tmp_path / 'broken.mp4'
+    pathname.write_bytes(box(b'ftyp', b'isom') + struct.pack('>I4s', 4, b'mdat') + bytes(100))
+    with open(pathname, 'rb') as file:
+        with pytest.raises(ValueError):
+            photosorter.read_isobmff_metadata(file)
+
+
+################################### HEIF ###########################################################
+
+@pytest.mark.parametrize('iinf_version, infe_version, iloc_version', [(0, 2, 0), (1, 3, 1), (0, 2, 2)])
+def test_heif_exif_item(tmp_path, iinf_version, infe_version, iloc_version):
+    pathname = tmp_path / 'photo.heic'
+    tiff = exif_block('2019:01:02 03:04:05', '5', (48.85, 2.35))
+    write_heif(pathname, tiff, iinf_version, infe_version, iloc_version)
+    with open(pathname, 'rb') as file:
+        assert photosorter.read_isobmff_metadata(file) == (tiff, {})
+    tags = photosorter.read_exif_tags(str(pathname))
+    assert tags['Image DateTime'] == '2019:01:02 03:04:05'
+    assert tags['EXIF SubSecTimeOriginal'] == '5'
+    assert 'GPS GPSLatitude' in tags
+    assert 'GPS GPSLatitude' not in photosorter.read_exif_tags(str(pathname), use_gps=False)
+
+
+def test_heif_without_exif_item():
+    infe = full_box(b'infe', 2, struct.pack('>H', 1) + b'\0\0hvc1\0')
+    iinf = bytes(4) + struct.pack('>H', 1) + infe
+    iloc = bytes([0, 0, 0, 0, 0x44, 0x00]) + struct.pack('>H', 0)
+    assert photosorter.find_heif_exif_extent(iinf, iloc) is None
+
+
+################################### JPEG ###########################################################
+
+def test_jpeg_exif_segment(tmp_path):
+    pathname = tmp_path / 'photo.jpg'
+    tiff = exif_block('2021:02:03 04:05:06', None, None)
+    write_jpeg(str(pathname), tiff, 1000)
+    with open(pathname, 'rb') as file:
+        assert photosorter.read_jpeg_exif_block(file) == tiff
+
+
+@pytest.mark.parametrize('length', [0, 1])
+def test_jpeg_invalid_segment_length(tmp_path, length):
+    pathname = tmp_path / 'broken.jpg'
+    pathname.write_bytes(b'\xff\xd8\xff\xe1' + struct.pack('>H', length) + b'Exif\0\0' + bytes(100000))
+    with open(pathname, 'rb') as file:
+        with pytest.raises(ValueError):
+            photosorter.read_jpeg_exif_block(file)
+        # Nothing read past the segment header, the file being left to exifread
+        assert file.tell() == 6
+
+
+################################### Dispatch #######################################################
+
+def test_unknown_format_falls_back_on_exifread(tmp_path):
+    pathname = tmp_path / 'junk.mp4'
+    pathname.write_bytes(b'garbage' * 10)
+    assert photosorter.read_exif_tags(str(pathname)) == {}
+
+
+def test_sort_keeps_extensions(tmp_path, monkeypatch):
+    creation = datetime(2020, 7, 8, 9, 10, 11, tzinfo=timezone.utc)
+    (tmp_path / 'clip.mp4').write_bytes(box(b'ftyp', b'isom\0\0\0\0isom')
+                                         + box(b'moov', full_box(b'mvhd', 0, struct.pack('>II', isobmff_seconds(creation), 0) + bytes(88))))
+    write_heif(tmp_path / 'IMG_0001.HEIC', exif_block('2019:01:02 03:04:05', None, None), 0, 2, 0)
+    write_png(tmp_path / 'photo.png', [png_chunk(b'eXIf', exif_block('2021:02:03 04:05:06', None, None))])
+    monkeypatch.setattr(sys, 'argv', ['photosorter.py', '--quiet', '--no-index', str(tmp_path)])
+    assert photosorter.main() == 0
+    local_creation = creation.astimezone()
+    assert sorted(filename for filename in os.listdir(tmp_path) if filename != photosorter.PHOTOSORTER_SUBDIR) == sorted([
+        '2019-01-02-03H04.heic', '2021-02-03-04H05.png', local_creation.strftime('%Y-%m-%d-%HH%M') + '.mp4'])
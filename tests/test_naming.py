@@ -0,0 +1,21 @@
+import photosorter_core as photosorter
+
+
+def test_existing_name_numbers(tmp_path):
+    for name in ['2021-06-15-10H20.jpg', '2021-06-15-10H20-1.jpg', '2021-06-15-10H20-3.jpg', '2021-06-15-10H21-2024.jpg', 'IMG_0001.jpg']:
+        (tmp_path / name).write_bytes(b'')
+    numbers = photosorter.existing_name_numbers(str(tmp_path), ignored_names={'IMG_0001.jpg'})
+    assert numbers['2021-06-15-10H20.jpg'] == 3
+    # Names ending with digits, such as given by a suffix, are used as is too
+    assert numbers['2021-06-15-10H21-2024.jpg'] == 0
+    assert 'IMG_0001.jpg' not in numbers
+    assert photosorter.existing_name_numbers(str(tmp_path / 'missing')) == {}
+
+
+def test_number_duplicate_names_after_existing_ones():
+    new_names = ['a.jpg', 'b.jpg', 'a.jpg', 'c-2024.jpg', 'd.jpg']
+    existing_numbers = {'a.jpg':2, 'c-2024.jpg':0}
+    collisions = photosorter.number_duplicate_names(new_names, lambda i: -i, existing_numbers.get)
+    # Photos sharing a name in order of their creation keys
+    assert new_names == ['a-4.jpg', 'b.jpg', 'a-3.jpg', 'c-2024-1.jpg', 'd.jpg']
+    assert collisions == 3
@@ -0,0 +1,133 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+from contextlib import closing
+from threading import Event
+
+import photosorter_core as photosorter
+from pipeline import exif_block, write_jpeg
+
+
+def test_journal_records_survive_a_killed_process(tmp_path):
+    # Killed without closing nor syncing the journal
+    script = f'''
+import os, sys
+sys.path.insert(0, {os.path.dirname(os.path.dirname(os.path.abspath(__file__)))!r})
+import photosorter_core
+journal = photosorter_core.RenameJournal({str(tmp_path)!r}, sync_count=1000000, sync_interval=3600)
+for number in range(3000):
+    journal.record(os.path.join({str(tmp_path)!r}, f'IMG_{{number}}.jpg'), os.path.join({str(tmp_path)!r}, f'{{number}}.jpg'))
+os._exit(1)
+'''
+    assert subprocess.run([sys.executable, '-c', script]).returncode == 1
+    photosorter_dir = tmp_path / photosorter.PHOTOSORTER_SUBDIR
+    assert os.listdir(photosorter_dir) == ['1.jsonl']
+    renames = list(photosorter.read_report(str(photosorter_dir / '1.jsonl'), str(tmp_path)))
+    assert len(renames) == 3000
+    assert renames[-1] == (str(tmp_path / 'IMG_2999.jpg'), str(tmp_path / '2999.jpg'))
+
+
+def write_report(directory, report_number:int, renames:list[tuple[str, str]]):
+    photosorter_dir = directory / photosorter.PHOTOSORTER_SUBDIR
+    photosorter_dir.mkdir(exist_ok=True)
+    lines = [json.dumps({'type':'header', 'version':photosorter.JOURNAL_VERSION, 'directory':str(directory)})]
+    lines += [json.dumps({'type':'rename', 'old':old_name, 'new':new_name}) for old_name, new_name in renames]
+    (photosorter_dir / f'{report_number}.jsonl').write_text('\n'.join(lines) + '\n')
+
+
+def write_files(directory, contents:dict):
+    for name, content in contents.items():
+        (directory / name).parent.mkdir(parents=True, exist_ok=True)
+        (directory / name).write_text(content)
+
+
+def list_files(directory) -> dict:
+    files = {}
+    for parent, dirnames, filenames in os.walk(directory):
+        dirnames[:] = [dirname for dirname in dirnames if dirname != photosorter.PHOTOSORTER_SUBDIR]
+        for filename in filenames:
+            with open(os.path.join(parent, filename)) as file:
+                files[os.path.relpath(os.path.join(parent, filename), directory)] = file.read()
+    return files
+
+
+def test_build_revert_plan_collapses_chained_renames(tmp_path):
+    write_report(tmp_path, 1, [('a.jpg', 'b.jpg'), ('x.jpg', 'y.jpg')])
+    write_report(tmp_path, 2, [('b.jpg', 'c.jpg'), ('y.jpg', 'x.jpg')])
+    reports = [str(tmp_path / photosorter.PHOTOSORTER_SUBDIR / f'{number}.jsonl') for number in (1, 2)]
+    # Renamed back to its original name : nothing to restore
+    assert photosorter.build_revert_plan(str(tmp_path), reports) == {str(tmp_path / 'c.jpg'):str(tmp_path / 'a.jpg')}
+
+
+def test_revert_chained_renames(tmp_path):
+    write_files(tmp_path, {os.path.join('2021', 'c.jpg'):'A', 'other.jpg':'O'})
+    write_report(tmp_path, 1, [('a.jpg', 'b.jpg')])
+    write_report(tmp_path, 2, [('b.jpg', os.path.join('2021', 'c.jpg'))])
+    assert photosorter.revert_directory(str(tmp_path), monitor=photosorter.Monitor(quiet=True)) == 0
+    assert list_files(tmp_path) == {'a.jpg':'A', 'other.jpg':'O'}
+    # Reports are removed, as well as emptied sorted directories
+    assert os.listdir(tmp_path / photosorter.PHOTOSORTER_SUBDIR) == []
+    assert not (tmp_path / '2021').exists()
+
+
+def test_revert_cycle(tmp_path):
+    # Names of a.jpg and b.jpg swapped through a temporary name
+    write_files(tmp_path, {'a.jpg':'B', 'b.jpg':'A'})
+    write_report(tmp_path, 1, [('a.jpg', 't.jpg'), ('b.jpg', 'a.jpg'), ('t.jpg', 'b.jpg')])
+    assert photosorter.revert_directory(str(tmp_path), monitor=photosorter.Monitor(quiet=True)) == 0
+    assert list_files(tmp_path) == {'a.jpg':'A', 'b.jpg':'B'}
+
+
+def test_revert_reports_in_numeric_order(tmp_path):
+    write_files(tmp_path, {'z.jpg':'X'})
+    write_report(tmp_path, 2, [('x.jpg', 'y.jpg')])
+    write_report(tmp_path, 10, [('y.jpg', 'z.jpg')])
+    assert photosorter.revert_directory(str(tmp_path), monitor=photosorter.Monitor(quiet=True)) == 0
+    assert list_files(tmp_path) == {'x.jpg':'X'}
+
+
+def test_revert_keeps_files_whose_original_name_is_used(tmp_path):
+    write_files(tmp_path, {'a.jpg':'new', 'b.jpg':'A'})
+    write_report(tmp_path, 1, [('a.jpg', 'b.jpg')])
+    monitor = photosorter.Monitor(quiet=True)
+    photosorter.revert_directory(str(tmp_path), monitor=monitor)
+    assert list_files(tmp_path) == {'a.jpg':'new', 'b.jpg':'A'}
+    assert monitor.counters['failures'] == 1
+
+
+def test_cancelled_revert_is_resumed(tmp_path):
+    names = [f'{number}.jpg' for number in range(5)]
+    write_files(tmp_path, {os.path.join('2021', name):name for name in names})
+    write_report(tmp_path, 1, [('IMG_' + name, os.path.join('2021', name)) for name in names])
+    cancel = Event()
+    monitor = photosorter.Monitor(quiet=True)
+    # Cancelled once the first file is restored
+    monitor.subscribe(lambda event, data: cancel.set() if event == 'restored' else None)
+    assert photosorter.revert_directory(str(tmp_path), monitor=monitor, cancel=cancel) == 2
+    files = list_files(tmp_path)
+    assert len([name for name in files if name.startswith('IMG_')]) == 1
+    assert len(files) == 5
+    # Restored file recorded in a new report, such that the next revert restores the other ones only
+    assert sorted(os.listdir(tmp_path / photosorter.PHOTOSORTER_SUBDIR)) == ['1.jsonl', '2.jsonl']
+    assert photosorter.revert_directory(str(tmp_path), monitor=photosorter.Monitor(quiet=True)) == 0
+    assert list_files(tmp_path) == {'IMG_' + name:name for name in names}
+
+
+def test_revert_relative_directory_updates_index(tmp_path, monkeypatch):
+    photos_dir = tmp_path / 'photos'
+    photos_dir.mkdir()
+    for number in range(3):
+        write_jpeg(str(photos_dir / f'IMG_{number}.jpg'), exif_block(f'2021:06:15 10:2{number}:30', None, None), 100)
+    monkeypatch.chdir(tmp_path)
+    sorter = photosorter.PhotoSorter(monitor=photosorter.Monitor(quiet=True))
+    list(sorter.process('photos'))
+    assert sorter.revert('photos') == 0
+    with closing(sqlite3.connect(photos_dir / photosorter.PHOTOSORTER_SUBDIR / photosorter.METADATA_INDEX_FILENAME)) as connection:
+        paths = sorted(path for path, in connection.execute('SELECT path FROM photos'))
+    assert paths == [str(photos_dir / f'IMG_{number}.jpg') for number in range(3)]
+    # Reverted photos are found in the index
+    monitor = photosorter.Monitor(quiet=True)
+    list(photosorter.PhotoSorter(monitor=monitor).process('photos'))
+    assert monitor.counters['index_hits'] == 3
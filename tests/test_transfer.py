@@ -0,0 +1,321 @@
+import errno
+import os
+import sys
+
+import pytest
+
+import photosorter_core as photosorter
+from pipeline import exif_block, write_jpeg
+
+
+@pytest.fixture
+def archive_dir(tmp_path, monkeypatch):
+    """
+    Directory behaving as if on another file system : links and renames between it and the rest of tmp_path fail with EXDEV.
+    """
+    archive_dir = tmp_path / 'archive'
+    archive_dir.mkdir()
+    def cross_device(function):
+        def call(old_pathname, new_pathname, *args, **kwargs):
+            if str(old_pathname).startswith(str(archive_dir)) != str(new_pathname).startswith(str(archive_dir)):
+                raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+            return function(old_pathname, new_pathname, *args, **kwargs)
+        return call
+    for name in ('link', 'rename', 'replace'):
+        monkeypatch.setattr(os, name, cross_device(getattr(os, name)))
+    return archive_dir
+
+
+def write_file(pathname, data:bytes, mtime_ns:int = 1234567890123456789) -> bytes:
+    pathname.write_bytes(data)
+    os.chmod(pathname, 0o640)
+    os.utime(pathname, ns=(mtime_ns, mtime_ns))
+    return data
+
+
+def copy_with_fds(source_pathname, destination_pathname):
+    with open(source_pathname, 'rb', buffering=0) as source, open(destination_pathname, 'wb', buffering=0) as destination:
+        photosorter.copy_file_data(source.fileno(), destination.fileno(), os.path.getsize(source_pathname))
+
+
+def unsupported(error_number:int):
+    def call(*args):
+        raise OSError(error_number, os.strerror(error_number))
+    return call
+
+
+################################### copy_file_data #################################################
+
+@pytest.mark.parametrize('disabled', [[], ['copy_file_range'], ['copy_file_range', 'sendfile']])
+def test_copy_file_data_fallbacks(tmp_path, monkeypatch, disabled):
+    # Several chunks, the last one partial
+    monkeypatch.setattr(photosorter, 'TRANSFER_CHUNK_SIZE', 4096)
+    data = write_file(tmp_path / 'source', os.urandom(3 * 4096 + 100))
+    for name in disabled:
+        if hasattr(os, name):
+            monkeypatch.setattr(os, name, unsupported(errno.ENOSYS if name == 'copy_file_range' else errno.EINVAL))
+    copy_with_fds(tmp_path / 'source', tmp_path / 'destination')
+    assert (tmp_path / 'destination').read_bytes() == data
+
+
+@pytest.mark.skipif(not hasattr(os, 'copy_file_range'), reason='copy_file_range not available')
+def test_copy_file_data_resumes_after_partial_copy_file_range(tmp_path, monkeypatch):
+    monkeypatch.setattr(photosorter, 'TRANSFER_CHUNK_SIZE', 4096)
+    data = write_file(tmp_path / 'source', os.urandom(3 * 4096))
+    copy_file_range = os.copy_file_range
+    calls = []
+    def failing_copy_file_range(*args):
+        # Fails with EXDEV once a chunk is copied, as between some file systems
+        calls.append(args)
+        if len(calls) > 1:
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+        return copy_file_range(*args)
+    monkeypatch.setattr(os, 'copy_file_range', failing_copy_file_range)
+    if hasattr(os, 'sendfile'):
+        monkeypatch.setattr(os, 'sendfile', unsupported(errno.EINVAL))
+    copy_with_fds(tmp_path / 'source', tmp_path / 'destination')
+    assert (tmp_path / 'destination').read_bytes() == data
+
+
+@pytest.mark.skipif(not hasattr(os, 'copy_file_range'), reason='copy_file_range not available')
+def test_copy_file_data_raises_other_errors(tmp_path, monkeypatch):
+    write_file(tmp_path / 'source', b'data')
+    monkeypatch.setattr(os, 'copy_file_range', unsupported(errno.EIO))
+    with pytest.raises(OSError) as error:
+        copy_with_fds(tmp_path / 'source', tmp_path / 'destination')
+    assert error.value.errno == errno.EIO
+
+
+################################### copy_file ######################################################
+
+@pytest.mark.parametrize('verify', [False, True])
+def test_copy_file_preserves_content_and_metadata(tmp_path, verify):
+    data = write_file(tmp_path / 'source.jpg', os.urandom(10000))
+    photosorter.copy_file(str(tmp_path / 'source.jpg'), str(tmp_path / 'copy.jpg'), verify)
+    source_stat = os.stat(tmp_path / 'source.jpg')
+    copy_stat = os.stat(tmp_path / 'copy.jpg')
+    assert (tmp_path / 'copy.jpg').read_bytes() == data
+    assert copy_stat.st_mtime_ns == source_stat.st_mtime_ns
+    assert copy_stat.st_mode & 0o7777 == 0o640
+    assert sorted(os.listdir(tmp_path)) == ['copy.jpg', 'source.jpg']
+
+
+def test_copy_file_failed_verify_leaves_no_copy(tmp_path, monkeypatch):
+    write_file(tmp_path / 'source.jpg', os.urandom(10000))
+    hash_file = photosorter.hash_file
+    def corrupt_hash_file(pathname, size, sample_size=None):
+        digest = hash_file(pathname, size, sample_size)
+        return digest if pathname.endswith('source.jpg') else bytes(len(digest))
+    monkeypatch.setattr(photosorter, 'hash_file', corrupt_hash_file)
+    with pytest.raises(OSError) as error:
+        photosorter.copy_file(str(tmp_path / 'source.jpg'), str(tmp_path / 'copy.jpg'), verify=True)
+    assert error.value.errno == errno.EIO
+    assert os.listdir(tmp_path) == ['source.jpg']
+
+
+################################### move_file ######################################################
+
+def test_move_file_renames_on_same_file_system(tmp_path):
+    data = write_file(tmp_path / 'source.jpg', b'data')
+    records = []
+    monitor = photosorter.Monitor(quiet=True)
+    assert not photosorter.move_file(str(tmp_path / 'source.jpg'), str(tmp_path / 'moved.jpg'), record=records.append, monitor=monitor)
+    assert records == [False]
+    assert os.listdir(tmp_path) == ['moved.jpg']
+    assert (tmp_path / 'moved.jpg').read_bytes() == data
+    assert 'transfers' not in monitor.counters
+
+
+@pytest.mark.parametrize('verify', [False, True])
+def test_move_file_copies_across_file_systems(tmp_path, archive_dir, verify):
+    source_pathname = tmp_path / 'source.jpg'
+    data = write_file(source_pathname, os.urandom(10000))
+    mtime_ns = os.stat(source_pathname).st_mtime_ns
+    new_pathname = archive_dir / 'moved.jpg'
+    records = []
+    def record(copied):
+        # Source is only removed once the move is recorded
+        assert source_pathname.exists() and new_pathname.exists()
+        records.append(copied)
+    monitor = photosorter.Monitor(quiet=True)
+    assert photosorter.move_file(str(source_pathname), str(new_pathname), verify, record, monitor)
+    assert records == [True]
+    assert not source_pathname.exists()
+    assert new_pathname.read_bytes() == data
+    assert os.stat(new_pathname).st_mtime_ns == mtime_ns
+    assert monitor.counters['transfers'] == 1
+    assert monitor.counters['transfer_bytes'] == len(data)
+
+
+def test_move_file_failed_verify_keeps_source(tmp_path, archive_dir, monkeypatch):
+    source_pathname = tmp_path / 'source.jpg'
+    data = write_file(source_pathname, os.urandom(10000))
+    monkeypatch.setattr(photosorter, 'hash_file', lambda pathname, size, sample_size=None: pathname.encode('utf-8'))
+    records = []
+    with pytest.raises(OSError):
+        photosorter.move_file(str(source_pathname), str(archive_dir / 'moved.jpg'), verify=True, record=records.append)
+    assert records == []
+    assert source_pathname.read_bytes() == data
+    assert os.listdir(archive_dir) == []
+
+
+def test_copy_file_never_replaces_existing_file(tmp_path):
+    write_file(tmp_path / 'source.jpg', b'source')
+    (tmp_path / 'copy.jpg').write_bytes(b'existing')
+    with pytest.raises(FileExistsError):
+        photosorter.copy_file(str(tmp_path / 'source.jpg'), str(tmp_path / 'copy.jpg'))
+    assert (tmp_path / 'copy.jpg').read_bytes() == b'existing'
+    assert sorted(os.listdir(tmp_path)) == ['copy.jpg', 'source.jpg']
+
+
+def test_copy_file_uses_unique_temporary_files(tmp_path, monkeypatch):
+    write_file(tmp_path / 'first.jpg', b'first')
+    write_file(tmp_path / 'second.jpg', b'second')
+    rename_no_replace = photosorter.rename_no_replace
+    def copy_second_meanwhile(temporary_pathname, new_pathname):
+        # Another process copies to the same name before the first copy is published
+        monkeypatch.setattr(photosorter, 'rename_no_replace', rename_no_replace)
+        photosorter.copy_file(str(tmp_path / 'second.jpg'), new_pathname)
+        rename_no_replace(temporary_pathname, new_pathname)
+    monkeypatch.setattr(photosorter, 'rename_no_replace', copy_second_meanwhile)
+    with pytest.raises(FileExistsError):
+        photosorter.copy_file(str(tmp_path / 'first.jpg'), str(tmp_path / 'copy.jpg'))
+    assert (tmp_path / 'copy.jpg').read_bytes() == b'second'
+    assert sorted(os.listdir(tmp_path)) == ['copy.jpg', 'first.jpg', 'second.jpg']
+
+
+@pytest.mark.parametrize('cross_device', [False, True])
+def test_move_file_never_replaces_existing_file(tmp_path, archive_dir, cross_device):
+    source_pathname = tmp_path / 'source.jpg'
+    write_file(source_pathname, b'source')
+    new_pathname = (archive_dir if cross_device else tmp_path) / 'moved.jpg'
+    new_pathname.write_bytes(b'existing')
+    records = []
+    with pytest.raises(FileExistsError):
+        photosorter.move_file(str(source_pathname), str(new_pathname), record=records.append)
+    assert records == []
+    assert source_pathname.read_bytes() == b'source'
+    assert new_pathname.read_bytes() == b'existing'
+
+
+@pytest.mark.parametrize('error_number', [errno.EPERM, errno.EOPNOTSUPP])
+def test_rename_no_replace_without_links(tmp_path, monkeypatch, error_number):
+    monkeypatch.setattr(os, 'link', unsupported(error_number))
+    (tmp_path / 'source.jpg').write_bytes(b'source')
+    photosorter.rename_no_replace(str(tmp_path / 'source.jpg'), str(tmp_path / 'moved.jpg'))
+    assert os.listdir(tmp_path) == ['moved.jpg']
+    assert (tmp_path / 'moved.jpg').read_bytes() == b'source'
+    (tmp_path / 'source.jpg').write_bytes(b'other')
+    with pytest.raises(FileExistsError):
+        photosorter.rename_no_replace(str(tmp_path / 'source.jpg'), str(tmp_path / 'moved.jpg'))
+    assert (tmp_path / 'moved.jpg').read_bytes() == b'source'
+
+
+def test_move_file_raises_other_errors(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        photosorter.move_file(str(tmp_path / 'missing.jpg'), str(tmp_path / 'moved.jpg'))
+
+
+@pytest.mark.skipif(not os.path.isdir('/dev/shm'), reason='no tmpfs in /dev/shm')
+def test_move_file_to_another_file_system(tmp_path):
+    other_dir = os.path.join('/dev/shm', f'photosorter-test-{os.getpid()}')
+    os.mkdir(other_dir)
+    try:
+        if os.stat(other_dir).st_dev == os.stat(tmp_path).st_dev:
+            pytest.skip('/dev/shm is on the same file system')
+        data = write_file(tmp_path / 'source.jpg', os.urandom(10000))
+        new_pathname = os.path.join(other_dir, 'moved.jpg')
+        assert photosorter.move_file(str(tmp_path / 'source.jpg'), new_pathname, verify=True)
+        with open(new_pathname, 'rb') as moved_file:
+            assert moved_file.read() == data
+        assert not (tmp_path / 'source.jpg').exists()
+    finally:
+        for filename in os.listdir(other_dir):
+            os.remove(os.path.join(other_dir, filename))
+        os.rmdir(other_dir)
+
+
+################################### Command line ###################################################
+
+def write_photos(directory, date_time:str, count:int) -> dict:
+    """
+    @return content of each written photo by name.
+    """
+    directory.mkdir(exist_ok=True)
+    photos = {}
+    for number in range(count):
+        pathname = directory / f'IMG_{number:04d}.jpg'
+        write_jpeg(str(pathname), exif_block(date_time, None, None), 1000)
+        photos[pathname.name] = pathname.read_bytes()
+    return photos
+
+
+def list_files(directory) -> dict:
+    """
+    @return content of each file below directory, except the ones of photosorter, by relative pathname.
+    """
+    files = {}
+    for parent, dirnames, filenames in os.walk(directory):
+        dirnames[:] = [dirname for dirname in dirnames if dirname != photosorter.PHOTOSORTER_SUBDIR]
+        for filename in filenames:
+            pathname = os.path.join(parent, filename)
+            with open(pathname, 'rb') as photo_file:
+                files[os.path.relpath(pathname, directory)] = photo_file.read()
+    return files
+
+
+def run_main(monkeypatch, *arguments) -> int:
+    monkeypatch.setattr(sys, 'argv', ['photosorter.py', '--quiet', *arguments])
+    return photosorter.main()
+
+
+def test_output_then_revert(tmp_path, archive_dir, monkeypatch):
+    ingest_dir = tmp_path / 'ingest'
+    photos = write_photos(ingest_dir, '2021:06:15 10:20:30', 3)
+    assert run_main(monkeypatch, str(ingest_dir), '--year', '--output', str(archive_dir), '--verify') == 0
+    assert list_files(ingest_dir) == {}
+    sorted_files = list_files(archive_dir)
+    assert len(sorted_files) == 3
+    assert all(pathname.startswith('2021' + os.sep) for pathname in sorted_files)
+    assert sorted(sorted_files.values()) == sorted(photos.values())
+
+    assert run_main(monkeypatch, str(ingest_dir), '--revert') == 0
+    assert list_files(ingest_dir) == photos
+    # Sorted directories created in the output are removed once empty
+    assert os.listdir(archive_dir) == []
+
+
+def test_output_numbers_names_after_previous_batches(tmp_path, archive_dir, monkeypatch):
+    ingest_dir = tmp_path / 'ingest'
+    first_photos = write_photos(ingest_dir, '2021:06:15 10:20:30', 2)
+    assert run_main(monkeypatch, str(ingest_dir), '--output', str(archive_dir)) == 0
+    first_files = list_files(archive_dir)
+    # Next batch, with the same dates and names as the previous one
+    second_photos = write_photos(ingest_dir, '2021:06:15 10:20:30', 2)
+    assert run_main(monkeypatch, str(ingest_dir), '--output', str(archive_dir)) == 0
+    files = list_files(archive_dir)
+    assert len(files) == 4
+    assert all(files[pathname] == content for pathname, content in first_files.items())
+    assert sorted(files.values()) == sorted([*first_photos.values(), *second_photos.values()])
+    # Numbered after the existing names, rather than getting a second number
+    assert sorted(files) == [f'2021-06-15-10H20-{number}.jpg' for number in range(1, 5)]
+
+
+def test_output_with_suffix_ending_with_digits(tmp_path, archive_dir, monkeypatch):
+    ingest_dir = tmp_path / 'ingest'
+    for batch in range(2):
+        write_photos(ingest_dir, '2021:06:15 10:20:30', 1)
+        assert run_main(monkeypatch, str(ingest_dir), '--suffix', '2024', '--output', str(archive_dir)) == 0
+        assert list_files(ingest_dir) == {}
+    assert sorted(list_files(archive_dir)) == ['2021-06-15-10H20-2024-1.jpg', '2021-06-15-10H20-2024.jpg']
+
+
+def test_output_takes_a_single_directory(tmp_path, archive_dir, monkeypatch, capsys):
+    photos = write_photos(tmp_path / 'first', '2021:06:15 10:20:30', 1)
+    write_photos(tmp_path / 'second', '2021:06:15 10:20:30', 1)
+    with pytest.raises(SystemExit) as exit:
+        run_main(monkeypatch, str(tmp_path / 'first'), str(tmp_path / 'second'), '--output', str(archive_dir))
+    assert exit.value.code == 2
+    assert '--output' in capsys.readouterr().err
+    assert list_files(tmp_path / 'first') == photos
+    assert os.listdir(archive_dir) == []